@@ -0,0 +1,211 @@
+"""
+Fan-out of auction price updates.
+
+Updates are published once the bid is committed and conflated per auction:
+during a short window only the highest price is kept together with the number
+of bids it covers, and a single frame goes out when the window closes. A hot
+auction therefore publishes a bounded number of frames per second no matter
+how many bids it receives.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from celery import shared_task
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import compact, live, metrics
+
+logger = logging.getLogger('auction')
+
+PENDING_UPDATE_KEY = "auction_update_pending:{auction_id}"
+FLUSH_SCHEDULED_KEY = "auction_update_flush:{auction_id}"
+PENDING_UPDATE_TTL_MS = 60 * 1000
+LAST_UPDATE_KEY = "auction_update_last:{auction_id}"
+GROUP_SEND_CONCURRENCY = 50
+
+# Keeps the highest priced message of the window and counts the bids folded
+# into it, returns 1 when the caller has to schedule the flush.
+CONFLATE_SCRIPT = """
+local price = redis.call('HGET', KEYS[1], 'price')
+if not price or tonumber(ARGV[1]) >= tonumber(price) then
+    redis.call('HSET', KEYS[1], 'price', ARGV[1], 'message', ARGV[2])
+end
+redis.call('HINCRBY', KEYS[1], 'bid_count', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+if redis.call('SET', KEYS[2], 1, 'NX', 'PX', ARGV[4]) then
+    return 1
+end
+return 0
+"""
+
+# Numbers the event, updates (ARGV[1] set) are also swapped in as the last
+# one sent. Returns the sequence number and the update before it for deltas.
+SEQUENCE_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+local previous = false
+if ARGV[1] ~= '' then
+    previous = redis.call('GET', KEYS[2])
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+end
+return {seq, previous}
+"""
+
+
+def encode_frame(frame_type, data) -> str:
+    """
+    The text frame websocket clients receive. It is built once by the producer
+    and consumers forward it as is, instead of every socket encoding the same
+    message again.
+    """
+    return json.dumps({'type': frame_type, 'data': data})
+
+
+def next_sequence(auction_id, update=None, client=None) -> tuple[int, dict | None]:
+    """
+    Numbers the next event of the auction. Pass the message of a price update
+    to also get the update sent before it, the base of its delta frame.
+    """
+    client = client or live.get_redis_client()
+    seq, previous = client.register_script(SEQUENCE_SCRIPT)(
+        keys=[
+            live.EVENT_SEQUENCE_KEY.format(auction_id=auction_id),
+            LAST_UPDATE_KEY.format(auction_id=auction_id),
+        ],
+        args=[json.dumps(update) if update is not None else '', live.EVENT_TTL_MS],
+    )
+    return seq, json.loads(previous) if previous else None
+
+
+def send_update(auction_id, message, client=None):
+    """
+    Sends a price update to everyone watching the auction right away, numbered
+    with the auction's event sequence, carrying the current viewer count and
+    encoded for JSON and compact sockets.
+    """
+    client = client or live.get_redis_client()
+    channel_layer = get_channel_layer()
+    with metrics.timed('broadcast'):
+        seq, previous = next_sequence(auction_id, update=message, client=client)
+        message = {
+            **message,
+            "viewers": live.count_viewers(auction_id, client=client),
+            "auction_id": str(auction_id),
+            "seq": seq,
+        }
+        frame = encode_frame('auction_update', message)
+        compact_frame = compact.encode_update(message)
+        live.append_event(auction_id, seq, frame, compact_frame, client=client)
+        async_to_sync(channel_layer.group_send)(  # type:ignore
+            f"auction_{auction_id}",
+            {
+                "type": "auction.update",
+                "auction_id": str(auction_id),
+                "seq": seq,
+                "frame": frame,
+                "compact": compact_frame,
+                "compact_delta": compact.encode_delta(message, previous) if previous else None,
+            }
+        )
+
+
+def send_closed(auction_id, message, client=None):
+    """Tells everyone watching the auction that it is over."""
+    send_events('auction.closed', 'auction_closed', {auction_id: message}, client=client)
+
+
+def send_phase(auction_id, message, client=None):
+    """Tells everyone watching the auction that it entered another phase, see `phases`."""
+    send_events('auction.phase', 'auction_phase', {auction_id: message}, client=client)
+
+
+def send_events(event_type, frame_type, messages, client=None):
+    """
+    Numbers, keeps and sends events other than price updates, `messages` maps
+    auction ids to their message. However many auctions there are, numbering
+    and keeping take one Redis round trip each and the group sends overlap.
+    """
+    client = client or live.get_redis_client()
+    if not messages:
+        return
+    pipe = client.pipeline(transaction=False)
+    for auction_id in messages:
+        sequence_key = live.EVENT_SEQUENCE_KEY.format(auction_id=auction_id)
+        pipe.incr(sequence_key)
+        pipe.pexpire(sequence_key, live.EVENT_TTL_MS)
+    seqs = pipe.execute()[::2]
+
+    kept = []
+    group_events = []
+    for (auction_id, message), seq in zip(messages.items(), seqs):
+        message = {**message, "auction_id": str(auction_id), "seq": seq}
+        frame = encode_frame(frame_type, message)
+        compact_frame = compact.pack(frame_type, message)
+        kept.append((auction_id, seq, frame, compact_frame))
+        group_events.append((f"auction_{auction_id}", {
+            "type": event_type,
+            "auction_id": str(auction_id),
+            "seq": seq,
+            "frame": frame,
+            "compact": compact_frame,
+        }))
+    live.append_events(kept, client=client)
+    async_to_sync(_group_send_all)(group_events)
+
+
+async def _group_send_all(group_events):
+    channel_layer = get_channel_layer()
+    # bounded so a large batch does not run the channel layer out of connections
+    in_flight = asyncio.Semaphore(GROUP_SEND_CONCURRENCY)
+
+    async def group_send(group, event):
+        async with in_flight:
+            await channel_layer.group_send(group, event)  # type:ignore
+
+    await asyncio.gather(*[group_send(group, event) for group, event in group_events])
+
+
+def publish_update(auction_id, message, bid_count=1, client=None):
+    """
+    Queues a price update for the auction. Call it once the bids are
+    committed, e.g. from ``transaction.on_commit``.
+    """
+    window_ms = settings.AUCTION_BROADCAST_WINDOW_MS
+    if window_ms <= 0:
+        return send_update(auction_id, {**message, "bid_count": bid_count})
+
+    client = client or live.get_redis_client()
+    schedule_flush = client.register_script(CONFLATE_SCRIPT)(
+        keys=[
+            PENDING_UPDATE_KEY.format(auction_id=auction_id),
+            FLUSH_SCHEDULED_KEY.format(auction_id=auction_id),
+        ],
+        # the flag outlives the window so a lost flush is retried by the next bid
+        args=[message['new_price'], json.dumps(message), bid_count, window_ms * 10, PENDING_UPDATE_TTL_MS],
+    )
+    if schedule_flush:
+        flush_auction_update.apply_async(  # type:ignore
+            kwargs={"auction_id": str(auction_id)}, countdown=window_ms / 1000)
+
+
+@shared_task(name='flush_auction_update')
+def flush_auction_update(auction_id):
+    """Sends the conflated update of the window that just closed."""
+    client = live.get_redis_client()
+    pipe = client.pipeline()
+    pipe.hgetall(PENDING_UPDATE_KEY.format(auction_id=auction_id))
+    pipe.delete(
+        PENDING_UPDATE_KEY.format(auction_id=auction_id),
+        FLUSH_SCHEDULED_KEY.format(auction_id=auction_id),
+    )
+    pending, _ = pipe.execute()
+    if not pending:
+        return "Nothing to send."
+
+    message = json.loads(pending[b'message'])
+    message['bid_count'] = int(pending[b'bid_count'])
+    send_update(auction_id, message)
+    return f"Sent update covering {message['bid_count']} bids."
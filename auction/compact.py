@@ -0,0 +1,70 @@
+"""
+Compact websocket subprotocol for bandwidth constrained clients.
+
+Clients offering ``bidlord.msgpack.v1`` get binary msgpack frames. Price
+updates use a fixed array layout and, once the socket has received the
+previous update of the auction, only what changed since then:
+
+    [UPDATE, seq, price_cents, currency, bidder, timestamp_ms, bid_count, viewers]
+    [DELTA, seq, price_increase_cents, bidder or nil when unchanged, ms since previous, bid_count, viewers]
+
+``seq`` is the per-auction sequence number of the update, a client that sees
+a gap waits for the next full UPDATE frame. Every other frame is the msgpack
+encoding of the ``{type, data}`` object JSON clients receive.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+import msgpack
+
+SUBPROTOCOL = 'bidlord.msgpack.v1'
+
+UPDATE = 1
+DELTA = 2
+
+
+def pack(frame_type, data) -> bytes:
+    return msgpack.packb({'type': frame_type, 'data': data}, use_bin_type=True)
+
+
+def unpack(raw):
+    """Decodes a client frame, raises ValueError for anything that is not msgpack."""
+    try:
+        return msgpack.unpackb(raw, raw=False)
+    except Exception as e:
+        raise ValueError(f"Invalid msgpack frame: {e}") from e
+
+
+def encode_update(message) -> bytes:
+    return msgpack.packb([
+        UPDATE,
+        message['seq'],
+        _cents(message['new_price']),
+        message.get('currency'),
+        message.get('bidder'),
+        _millis(message['timestamp']),
+        message.get('bid_count', 1),
+        message.get('viewers', 0),
+    ], use_bin_type=True)
+
+
+def encode_delta(message, previous) -> bytes:
+    """`message` as a change against `previous`, the update right before it."""
+    bidder = message.get('bidder')
+    return msgpack.packb([
+        DELTA,
+        message['seq'],
+        _cents(message['new_price']) - _cents(previous['new_price']),
+        None if bidder == previous.get('bidder') else bidder,
+        _millis(message['timestamp']) - _millis(previous['timestamp']),
+        message.get('bid_count', 1),
+        message.get('viewers', 0),
+    ], use_bin_type=True)
+
+
+def _cents(price) -> int:
+    return int(Decimal(price) * 100)
+
+
+def _millis(timestamp) -> int:
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
@@ -1,40 +1,411 @@
+import asyncio
 import json
 import logging
+import uuid
+from functools import partial
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import compact, identity, live
+from .outbox import LatestValueOutbox, record_connection_stats
+from .results import user_group_name
+from .tasks import submit_bid
 
 logger = logging.getLogger('auction')
 
+# close code for clients that stayed too far behind their updates
+LAGGING_CLOSE_CODE = 4008
+
 
 class AuctionConsumer(AsyncWebsocketConsumer):
+    # group messages are delivered through the outbox once the socket is accepted
+    outbox = None
+    outbox_task = None
+    lagging = False
+    viewer_task = None
+
     async def connect(self):
         self.auction_id = self.scope.get('url_route', {}).get(
             'kwargs', {}).get('auction_id')
-        self.auction_group_name = f'auction_{self.auction_id}'
+        self.auction_group_name = None
+        self.user_id = None
+        self.username = None
+        self.user_group_name = None
+        # per auction, the last event number the client has and the last update
+        # frame it got, which compact sockets get deltas against
+        self.last_seqs = {}
+        self.delta_bases = {}
+        self.compact = compact.SUBPROTOCOL in self.scope.get('subprotocols', [])
+
+        # only live auctions get a group, so typos and closed auctions leave nothing behind in the channel layer
+        is_live, final_state = (await sync_to_async(live.get_watch_states)([self.auction_id]))[str(self.auction_id)]
+        if not is_live:
+            return await self.reject_watch(final_state)
 
+        self.auction_group_name = f'auction_{self.auction_id}'
         await self.channel_layer.group_add(  # type: ignore
             self.auction_group_name,
             self.channel_name
         )
-        await self.accept()
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            self.username = user.username
+            await self.join_user_group(user.id)
+        await self.accept(subprotocol=compact.SUBPROTOCOL if self.compact else None)
+        self.start_outbox()
+        await self.mark_watching(self.watched_auction_ids())
+        self.viewer_task = asyncio.create_task(self.count_as_viewer())
         logger.info(f"websocker connected for auction {self.auction_id}")
+        await self.catch_up(self.requested_since())
+
+    async def reject_watch(self, final_state):
+        """Closed auctions get their final state once, unknown ones are refused."""
+        if final_state is None:
+            logger.info(f"Refused websocket for unknown auction {self.auction_id}")
+            return await self.close()
+        await self.accept(subprotocol=compact.SUBPROTOCOL if self.compact else None)
+        await self.send_frame('auction_closed', final_state)
+        await self.close()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(  # type: ignore
-            self.auction_group_name,
+        await self.stop_outbox()
+        self.stop_counting_as_viewer()
+        if self.auction_group_name:
+            await self.channel_layer.group_discard(  # type: ignore
+                self.auction_group_name,
+                self.channel_name
+            )
+        if self.user_group_name:
+            await self.channel_layer.group_discard(  # type: ignore
+                self.user_group_name,
+                self.channel_name
+            )
+        logger.info(f"Websocket disconnected for auction {self.auction_id}")
+
+    def start_outbox(self):
+        self.outbox = LatestValueOutbox()
+        self.outbox_task = asyncio.create_task(self.outbox.run())
+
+    async def stop_outbox(self):
+        if self.outbox_task is None:
+            return
+        self.outbox_task.cancel()
+        self.outbox_task = None
+        if self.outbox.dropped or self.lagging:  # type: ignore
+            logger.info(f"Websocket skipped {self.outbox.dropped} updates, lagging: {self.lagging}")  # type: ignore
+            try:
+                await sync_to_async(record_connection_stats)(self.outbox.dropped, self.lagging)  # type: ignore
+            except Exception as e:
+                logger.error(f"Error recording websocket stats: {e}")
+
+    def watched_auction_ids(self):
+        return [self.auction_id] if self.auction_group_name else []
+
+    async def mark_watching(self, auction_ids):
+        try:
+            await sync_to_async(live.mark_watching)(auction_ids, self.channel_name)
+        except Exception as e:
+            logger.error(f"Error counting websocket {self.channel_name} as viewer: {e}")
+
+    async def count_as_viewer(self):
+        """Keeps the socket counted among the viewers of what it watches while it is connected."""
+        while True:
+            await asyncio.sleep(live.VIEWER_WINDOW_SECONDS)
+            await self.mark_watching(self.watched_auction_ids())
+
+    def stop_counting_as_viewer(self):
+        if self.viewer_task is not None:
+            self.viewer_task.cancel()
+            self.viewer_task = None
+
+    async def enqueue(self, deliver, key=None):
+        """Hands a frame to the outbox, cutting off the client if it has fallen too far behind"""
+        if self.outbox is None:
+            return await deliver()
+        self.outbox.put(deliver, key)
+        if not self.lagging and self.outbox.lag() > settings.WEBSOCKET_MAX_LAG_SECONDS:
+            self.lagging = True
+            logger.warning(f"Closing websocket {self.channel_name}, {self.outbox.lag():.1f}s behind")
+            await self.close(code=LAGGING_CLOSE_CODE)
+
+    def requested_since(self):
+        """The ``since`` event number of a reconnecting client, from the query string"""
+        since = parse_qs(self.scope.get('query_string', b'').decode()).get('since', [''])[0]
+        return int(since) if since.isdigit() else None
+
+    async def catch_up(self, since):
+        """
+        Replays the events a reconnecting client missed after `since`, or sends
+        a snapshot when it is new or some of them are no longer kept
+        """
+        events = None
+        if since is not None:
+            try:
+                events = await sync_to_async(live.read_events_since)(self.auction_id, since)
+            except Exception as e:
+                logger.error(f"Error reading events of auction {self.auction_id}: {e}")
+        if events is None:
+            return await self.send_snapshot()
+        for seq, frame, compact_frame in events:
+            if self.compact:
+                await self.send(bytes_data=compact_frame)
+            else:
+                await self.send(text_data=frame)
+        self.last_seqs[str(self.auction_id)] = events[-1][0] if events else since
+        if events:
+            self.delta_bases[str(self.auction_id)] = events[-1][0]
+
+    async def send_snapshot(self, auction_id=None):
+        """Current state of the auction from its live record in Redis, so connecting never touches Postgres"""
+        auction_id = auction_id or self.auction_id
+        try:
+            snapshot = await sync_to_async(live.get_snapshot)(auction_id)
+        except Exception as e:
+            logger.error(f"Error reading snapshot of auction {auction_id}: {e}")
+            return
+        if snapshot is not None:
+            await self.send_frame('auction_snapshot', snapshot)
+            # events up to the snapshot are in it already
+            self.last_seqs[str(auction_id)] = snapshot['seq']
+
+    async def join_user_group(self, user_id):
+        """Results of the user's own bids are pushed to their personal group"""
+        self.user_id = str(user_id)
+        self.user_group_name = user_group_name(user_id)
+        await self.channel_layer.group_add(  # type: ignore
+            self.user_group_name,
             self.channel_name
         )
-        logger.info(f"Websocket disconnected for auction {self.auction_id}")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Accepts ``auth`` frames carrying a JWT access token and ``bid`` frames,
+        bids go through the same pipeline as PlaceBidAPIView and are acknowledged
+        on the socket, their final result follows as a ``bid_result`` message.
+        Compact sockets send the same objects as msgpack binary frames.
+        """
+        try:
+            if bytes_data is not None:
+                frame = compact.unpack(bytes_data)
+            else:
+                frame = json.loads(text_data or '')
+        except ValueError:
+            return await self.send_ack('error', detail="Frames must be JSON or msgpack")
+        if not isinstance(frame, dict):
+            return await self.send_ack('error', detail="Frames must be JSON objects")
+
+        action = frame.get('action')
+        if action == 'auth':
+            await self.authenticate(frame.get('token'))
+        elif action == 'bid':
+            await self.place_bid(frame.get('amount'), frame.get('ref'))
+        else:
+            await self.send_ack('error', detail=f"Unknown action {action!r}")
+
+    async def authenticate(self, token):
+        try:
+            user_id = AccessToken(token)[jwt_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError, TypeError):
+            return await self.send_ack('auth_ack', authenticated=False)
+        # like JWTAuthentication, the token alone is not enough once the user is deactivated or deleted
+        if not await sync_to_async(identity.is_active)(user_id):
+            logger.info(f"Refused websocket authentication of inactive user {user_id}")
+            return await self.send_ack('auth_ack', authenticated=False)
+        if self.user_group_name and self.user_id != str(user_id):
+            self.username = None
+            await self.channel_layer.group_discard(  # type: ignore
+                self.user_group_name,
+                self.channel_name
+            )
+        await self.join_user_group(user_id)
+        await self.send_ack('auth_ack', authenticated=True)
+
+    async def place_bid(self, amount, ref=None):
+        if self.user_id is None:
+            return await self.send_ack('bid_ack', ref=ref, status='rejected',
+                                       detail="Authentication required")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+            return await self.send_ack('bid_ack', ref=ref, status='rejected',
+                                       detail="A valid bid amount is required")
+        try:
+            verdict, bid_id = await database_sync_to_async(self.submit_bid)(float(amount))
+        except Exception as e:
+            logger.error(f"Error queueing websocket bid for auction {self.auction_id}: {e}")
+            return await self.send_ack('bid_ack', ref=ref, status='error',
+                                       detail="An error occured while placing your bid")
+        if verdict != live.ACCEPTED:
+            return await self.send_ack('bid_ack', ref=ref, status='rejected',
+                                       detail=live.REJECTION_MESSAGES[verdict])
+        await self.send_ack('bid_ack', ref=ref, status='queued', bid_id=bid_id)
+
+    def submit_bid(self, amount):
+        # the user may have been deactivated since the socket authenticated
+        if not identity.is_active(self.user_id):
+            return live.FORBIDDEN, None
+        # websocket bids skip the API's throttle, so they are limited per user here
+        if not live.take_bid_slot(self.user_id, settings.WEBSOCKET_BIDS_PER_SECOND):
+            return live.RATE_LIMITED, None
+        return submit_bid(self.user_id, str(self.auction_id), amount, bidder=self.username)
+
+    async def send_ack(self, ack_type, **data):
+        await self.send_frame(ack_type, data)
+
+    async def send_frame(self, frame_type, data):
+        if self.compact:
+            await self.send(bytes_data=compact.pack(frame_type, data))
+        else:
+            await self.send(text_data=json.dumps({
+                'type': frame_type,
+                'data': data
+            }))
+
+    # group events carry their frames already encoded by the producer, see broadcaster.encode_frame
+    async def forward(self, event):
+        if self.compact:
+            await self.send(bytes_data=event['compact'])
+        else:
+            await self.send(text_data=event['frame'])
 
     async def auction_update(self, event):
-        message = event['message']
-        await self.send(text_data=json.dumps({
-            'type': 'auction_update',
-            'data': message
-        }))
+        # latest value wins, an update still waiting for this auction is replaced
+        await self.enqueue(partial(self.write_update, event), key=('update', event.get('auction_id')))
+
+    def is_new(self, event):
+        """Records a numbered event as sent, False if the client already has it from a replay or snapshot"""
+        seq, auction_id = event.get('seq'), event.get('auction_id')
+        if seq is None:
+            return True
+        last_seq = self.last_seqs.get(auction_id)
+        if last_seq is not None and seq <= last_seq:
+            return False
+        self.last_seqs[auction_id] = seq
+        return True
+
+    async def write_update(self, event):
+        if not self.is_new(event):
+            return
+        if not self.compact:
+            return await self.send(text_data=event['frame'])
+        seq, auction_id = event['seq'], event.get('auction_id')
+        if event['compact_delta'] and self.delta_bases.get(auction_id) == seq - 1:
+            await self.send(bytes_data=event['compact_delta'])
+        else:
+            await self.send(bytes_data=event['compact'])
+        self.delta_bases[auction_id] = seq
+
+    async def write_event(self, event):
+        if self.is_new(event):
+            await self.forward(event)
 
     async def auction_closed(self, event):
-        message = event['message']
-        await self.send(text_data=json.dumps({
-            'type': 'auction_closed',
-            'data': message
-        }))
+        await self.enqueue(partial(self.write_event, event))
+
+    async def auction_phase(self, event):
+        await self.enqueue(partial(self.write_event, event))
+
+    async def bid_result(self, event):
+        await self.enqueue(partial(self.forward, event))
+
+
+class AuctionSubscriptionsConsumer(AuctionConsumer):
+    """
+    One socket watching many auctions. Clients manage what they watch with
+    ``subscribe`` and ``unsubscribe`` frames carrying ``auction_ids``, up to
+    AUCTION_SUBSCRIPTION_LIMIT auctions per connection. Every frame sent for
+    an auction carries its ``auction_id``. Only live auctions are joined,
+    closed ones get their final state once and unknown ones are listed as
+    ``unknown_ids`` in the ack. JSON only.
+    """
+    async def connect(self):
+        self.auction_ids = set()
+        self.compact = False
+        self.last_seqs = {}
+        self.delta_bases = {}
+        await self.accept()
+        self.start_outbox()
+        self.viewer_task = asyncio.create_task(self.count_as_viewer())
+
+    def watched_auction_ids(self):
+        return list(self.auction_ids)
+
+    async def disconnect(self, close_code):
+        await self.stop_outbox()
+        self.stop_counting_as_viewer()
+        for auction_id in self.auction_ids:
+            await self.channel_layer.group_discard(  # type: ignore
+                f'auction_{auction_id}',
+                self.channel_name
+            )
+        logger.info(f"Websocket disconnected from {len(self.auction_ids)} auctions")
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            frame = json.loads(text_data or '')
+        except ValueError:
+            return await self.send_ack('error', detail="Frames must be JSON")
+        if not isinstance(frame, dict):
+            return await self.send_ack('error', detail="Frames must be JSON objects")
+
+        action = frame.get('action')
+        if action not in ('subscribe', 'unsubscribe'):
+            return await self.send_ack('error', detail=f"Unknown action {action!r}")
+        auction_ids = frame.get('auction_ids', [])
+        # checked before parsing, no frame costs more than the limit
+        if isinstance(auction_ids, list) and len(auction_ids) > settings.AUCTION_SUBSCRIPTION_LIMIT:
+            return await self.reject_over_limit(action)
+        try:
+            auction_ids = [str(uuid.UUID(str(auction_id))) for auction_id in auction_ids]
+        except (ValueError, TypeError):
+            return await self.send_ack(f'{action}_ack', status='rejected',
+                                       detail="auction_ids must be a list of auction ids")
+        if action == 'subscribe':
+            await self.subscribe(auction_ids)
+        else:
+            await self.unsubscribe(auction_ids)
+
+    async def subscribe(self, auction_ids):
+        requested = [auction_id for auction_id in dict.fromkeys(auction_ids) if auction_id not in self.auction_ids]
+        # every requested id counts, before Redis tells which ones are live
+        if len(self.auction_ids) + len(requested) > settings.AUCTION_SUBSCRIPTION_LIMIT:
+            return await self.reject_over_limit('subscribe')
+        watch_states = await sync_to_async(live.get_watch_states)(requested)
+        new_ids = [auction_id for auction_id in requested if watch_states[auction_id][0]]
+        for auction_id in new_ids:
+            await self.channel_layer.group_add(  # type: ignore
+                f'auction_{auction_id}',
+                self.channel_name
+            )
+            self.auction_ids.add(auction_id)
+        if new_ids:
+            await self.mark_watching(new_ids)
+        unknown_ids = [auction_id for auction_id in requested if watch_states[auction_id] == (False, None)]
+        await self.send_ack('subscribe_ack', status='subscribed', auction_ids=sorted(self.auction_ids),
+                            unknown_ids=unknown_ids)
+        for auction_id in requested:
+            is_live, final_state = watch_states[auction_id]
+            if is_live:
+                await self.send_snapshot(auction_id)
+            elif final_state is not None:
+                await self.send_frame('auction_closed', final_state)
+
+    async def reject_over_limit(self, action):
+        limit = settings.AUCTION_SUBSCRIPTION_LIMIT
+        await self.send_ack(f'{action}_ack', status='rejected',
+                            detail=f"At most {limit} auctions can be watched per connection",
+                            auction_ids=sorted(self.auction_ids))
+
+    async def unsubscribe(self, auction_ids):
+        for auction_id in auction_ids:
+            if auction_id in self.auction_ids:
+                await self.channel_layer.group_discard(  # type: ignore
+                    f'auction_{auction_id}',
+                    self.channel_name
+                )
+                self.auction_ids.discard(auction_id)
+        await self.send_ack('unsubscribe_ack', status='unsubscribed', auction_ids=sorted(self.auction_ids))
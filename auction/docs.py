@@ -292,7 +292,8 @@ def place_bid_doc():
     return extend_schema(
         operation_id="place_bid_on_auction",
         summary="Place a bid on an auction",
-        description="Submits a bid for an active auction. The request is queued and processed asynchronously.",
+        description="Submits a bid for an active auction. Bids that cannot beat the current price are rejected immediately, "
+                    "the rest are queued and processed asynchronously.",
         request={
             'application/json': {
                 'type': 'object',
@@ -303,10 +304,26 @@ def place_bid_doc():
             }
         },
         responses={
-            202: OpenApiResponse(description="Bid received and is being processed."),
+            202: OpenApiResponse(description="Bid received and is being processed, the response carries the `bid_id` to look up its result."),
             400: OpenApiResponse(description="Invalid bid amount."),
             401: OpenApiResponse(description="Authentication required."),
-            404: OpenApiResponse(description="Auction not found or not active.")
+            404: OpenApiResponse(description="Auction not found or not active."),
+            409: OpenApiResponse(description="Bid is not higher than the current price or the auction is not accepting bids.")
+        },
+        tags=['Bids']
+    )
+
+
+def bid_result_doc():
+    return extend_schema(
+        operation_id="get_bid_result",
+        summary="Get the result of a queued bid",
+        description="Returns the status of a bid placed by the current user: pending, accepted, rejected or failed. "
+                    "Results are kept for 10 minutes and are also pushed over the auction websocket.",
+        responses={
+            200: OpenApiResponse(description="Bid result."),
+            401: OpenApiResponse(description="Authentication required."),
+            404: OpenApiResponse(description="Bid result not found or expired.")
         },
         tags=['Bids']
     )
@@ -333,5 +350,5 @@ def master_search_doc():
 
 __all__ = ['auction_item_create_doc', 'auction_item_detail_doc',
            'auction_item_list_doc', 'auction_item_edit_doc', 'auction_item_delete_doc', 'auction_item_image_create_doc', 'auction_item_image_list_doc', 'auction_item_image_delete_doc',
-           'auction_list_and_detail_doc', 'place_bid_doc','master_search_doc'
+           'auction_list_and_detail_doc', 'place_bid_doc', 'bid_result_doc', 'master_search_doc'
            ]
@@ -0,0 +1,65 @@
+"""
+Display names of users, cached in one Redis hash so broadcasts can name the
+bidder or winner without querying the user table. Whether a user may still
+act is cached the same way, for websocket bids that only carry a token.
+"""
+import logging
+
+from django.contrib.auth import get_user_model
+
+from . import live
+
+logger = logging.getLogger('auction')
+User = get_user_model()
+
+USERNAMES_KEY = "user_names"
+# "1" for active users, "0" for deactivated and deleted ones
+ACTIVE_USERS_KEY = "user_active"
+
+
+def get_usernames(user_ids, client=None) -> dict[str, str]:
+    """Maps each user id (as a string) to its username, loading cache misses in one query."""
+    client = client or live.get_redis_client()
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+    if not user_ids:
+        return {}
+    usernames = {
+        user_id: username.decode('utf-8')
+        for user_id, username in zip(user_ids, client.hmget(USERNAMES_KEY, user_ids))
+        if username is not None
+    }
+    missing = [user_id for user_id in user_ids if user_id not in usernames]
+    if missing:
+        loaded = {
+            str(user_id): username
+            for user_id, username in User.objects.filter(id__in=missing).values_list('id', 'username')
+        }
+        if loaded:
+            client.hset(USERNAMES_KEY, mapping=loaded)
+        usernames.update(loaded)
+    return usernames
+
+
+def get_username(user_id, client=None) -> str | None:
+    return get_usernames([user_id], client=client).get(str(user_id))
+
+
+def remember_username(user_id, username, client=None):
+    client = client or live.get_redis_client()
+    client.hset(USERNAMES_KEY, str(user_id), username)
+
+
+def is_active(user_id, client=None) -> bool:
+    """Whether the user exists and is active, loaded from the user table on a cache miss."""
+    client = client or live.get_redis_client()
+    cached = client.hget(ACTIVE_USERS_KEY, str(user_id))
+    if cached is not None:
+        return cached == b'1'
+    active = User.objects.filter(id=user_id, is_active=True).exists()
+    remember_active(user_id, active, client=client)
+    return active
+
+
+def remember_active(user_id, active, client=None):
+    client = client or live.get_redis_client()
+    client.hset(ACTIVE_USERS_KEY, str(user_id), int(active))
@@ -0,0 +1,507 @@
+"""
+Redis-resident state for live auctions.
+
+Every live auction keeps a small hash at ``live_auction:<auction_id>`` with its
+current price and bidding window, so the bid pipeline can compare and raise the
+price in a single atomic script instead of locking and re-reading Postgres.
+Its highest bids are kept next to it in a sorted set, which together with the
+hash is all a websocket client needs to render the auction when it connects.
+"""
+import json
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+logger = logging.getLogger('auction')
+
+LIVE_AUCTION_KEY = "live_auction:{auction_id}"
+RECENT_BIDS_KEY = "live_auction_bids:{auction_id}"
+RECENT_BIDS_LIMIT = 5
+# ids of ongoing auctions, the only ones websockets may watch
+LIVE_AUCTION_IDS_KEY = "live_auction_ids"
+# final state of a closed auction, sent once to sockets that still ask for it
+FINAL_STATE_KEY = "auction_final:{auction_id}"
+FINAL_STATE_TTL = 24 * 60 * 60
+# every event sent to an auction's watchers is numbered and kept in a bounded
+# stream under its number, so reconnecting sockets can catch up on what they missed
+EVENT_SEQUENCE_KEY = "auction_event_seq:{auction_id}"
+EVENT_STREAM_KEY = "auction_events:{auction_id}"
+EVENT_STREAM_LENGTH = 200
+EVENT_TTL_MS = 24 * 60 * 60 * 1000
+# sockets watching an auction are added to a HyperLogLog per time window and
+# re-added every window while connected, so the union of the current and the
+# previous window counts them approximately in constant memory
+VIEWERS_KEY = "auction_viewers:{auction_id}:{window}"
+VIEWER_WINDOW_SECONDS = 30
+# bids a user sent over websockets in a second, counted across all their sockets
+BID_RATE_KEY = "websocket_bid_rate:{user_id}:{second}"
+# keep records around for a while after the auction ends so late bids are
+# still rejected from Redis instead of falling through to Postgres
+LIVE_AUCTION_GRACE_SECONDS = 60 * 60
+
+ACCEPTED = 'accepted'
+TOO_LOW = 'too_low'
+INACTIVE = 'inactive'
+MISSING = 'missing'
+RATE_LIMITED = 'rate_limited'
+FORBIDDEN = 'forbidden'
+
+REJECTION_MESSAGES = {
+    TOO_LOW: "Bid amount must be higher than current price",
+    INACTIVE: "Auction is not accepting bids",
+    MISSING: "Auction not found or not active",
+    RATE_LIMITED: "Too many bids, slow down",
+    FORBIDDEN: "Your account cannot place bids",
+}
+
+# Only writes the record if it does not exist yet, so a late prime from
+# Postgres can never overwrite a price that was already raised in Redis.
+# ARGV[7..] are (amount, bid) pairs for the recent bids.
+PRIME_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1],
+    'price', ARGV[1], 'start_ts', ARGV[2], 'end_ts', ARGV[3],
+    'currency', ARGV[4], 'bid_count', ARGV[5])
+redis.call('EXPIREAT', KEYS[1], ARGV[6])
+redis.call('DEL', KEYS[2])
+if #ARGV > 6 then
+    for i = 7, #ARGV, 2 do
+        redis.call('ZADD', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('EXPIREAT', KEYS[2], ARGV[6])
+end
+return 1
+"""
+
+# Adds the (amount, bid) pairs from ARGV[first] on to the recent bids in
+# KEYS[2], keeps the ARGV[first - 1] highest and expires them with KEYS[1].
+RECORD_BIDS = """
+local function record_bids(first)
+    if #ARGV < first then
+        return
+    end
+    for i = first, #ARGV, 2 do
+        redis.call('ZADD', KEYS[2], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[first - 1]) - 1)
+    local ttl = redis.call('PTTL', KEYS[1])
+    if ttl > 0 then
+        redis.call('PEXPIRE', KEYS[2], ttl)
+    end
+end
+"""
+
+# The accepted bid is also kept as the record's top bid, so the closer can
+# settle the auction on it even if its write-behind has not landed yet.
+ACCEPT_BID_SCRIPT = RECORD_BIDS + """
+local state = redis.call('HMGET', KEYS[1], 'price', 'start_ts', 'end_ts', 'currency')
+if not state[1] then
+    return {'missing', '', ''}
+end
+local now = tonumber(ARGV[2])
+if now < tonumber(state[2]) or now > tonumber(state[3]) then
+    return {'inactive', state[1], state[4]}
+end
+if tonumber(ARGV[1]) <= tonumber(state[1]) then
+    return {'too_low', state[1], state[4]}
+end
+redis.call('HSET', KEYS[1], 'price', ARGV[1], 'top_bid', ARGV[3])
+redis.call('HINCRBY', KEYS[1], 'bid_count', 1)
+record_bids(5)
+return {'accepted', ARGV[1], state[4]}
+"""
+
+# Moves the end of the bidding window of an existing record, and when it and
+# its recent bids expire with it. ARGV[1] is the new end, ARGV[2] the expiry.
+MOVE_END_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'end_ts', ARGV[1])
+redis.call('EXPIREAT', KEYS[1], ARGV[2])
+redis.call('EXPIREAT', KEYS[2], ARGV[2])
+return 1
+"""
+
+# Keeps the cached record current for bids committed outside of Redis. The
+# price only moves up, but every committed bid is counted and recorded even
+# when a higher one got there first.
+RAISE_PRICE_SCRIPT = RECORD_BIDS + """
+local price = redis.call('HGET', KEYS[1], 'price')
+if not price then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'bid_count', ARGV[2])
+record_bids(4)
+if tonumber(ARGV[1]) <= tonumber(price) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'price', ARGV[1])
+return 1
+"""
+
+
+# Removes and returns up to ARGV[2] members of the KEYS[1] sorted set scored
+# up to ARGV[1], claiming them atomically so concurrent runners never both get one.
+CLAIM_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+def get_redis_client():
+    return cache.client.get_client()  # type:ignore
+
+
+def live_auction_key(auction_id) -> str:
+    return LIVE_AUCTION_KEY.format(auction_id=auction_id)
+
+
+def recent_bids_key(auction_id) -> str:
+    return RECENT_BIDS_KEY.format(auction_id=auction_id)
+
+
+def format_price(amount) -> str:
+    return f"{amount:.2f}"
+
+
+def bid_entry(amount, bidder, timestamp) -> str:
+    """A bid as it is kept in the recent bids of a live auction."""
+    return json.dumps({
+        "amount": format_price(amount),
+        "bidder": bidder,
+        "timestamp": timestamp.isoformat(),
+    })
+
+
+def _bid_args(entries) -> list:
+    args = []
+    for entry in entries:
+        args += [json.loads(entry)['amount'], entry]
+    return args
+
+
+def prime_live_auction(auction, bid_count=0, recent_bids=(), client=None) -> bool:
+    """Write the live record for an auction unless one already exists."""
+    client = client or get_redis_client()
+    item = auction.item_for_sale
+    end_ts = item.auction_end_date.timestamp()
+    created = client.register_script(PRIME_SCRIPT)(
+        keys=[live_auction_key(auction.id), recent_bids_key(auction.id)],
+        args=[
+            format_price(auction.current_price),
+            item.auction_start_date.timestamp(),
+            end_ts,
+            item.price_currency,
+            bid_count,
+            int(end_ts) + LIVE_AUCTION_GRACE_SECONDS,
+            *_bid_args(recent_bids),
+        ],
+    )
+    return bool(created)
+
+
+def move_live_end(auction_id, ends_at, client=None) -> bool:
+    """Moves the end of a live record's bidding window, returns False if there is no record."""
+    client = client or get_redis_client()
+    end_ts = ends_at.timestamp()
+    moved = client.register_script(MOVE_END_SCRIPT)(
+        keys=[live_auction_key(auction_id), recent_bids_key(auction_id)],
+        args=[end_ts, int(end_ts) + LIVE_AUCTION_GRACE_SECONDS],
+    )
+    return bool(moved)
+
+
+def load_live_auction(auction_id, client=None) -> bool:
+    """Prime the live record from Postgres, returns False if there is no such ongoing auction."""
+    from .models import Auction, Bid
+
+    auction = Auction.objects.select_related('item_for_sale').annotate(
+        bid_total=Count('active_bids')
+    ).filter(id=auction_id, ongoing=True).first()
+    if auction is None:
+        return False
+    recent_bids = [
+        bid_entry(amount, username, created_at)
+        for amount, username, created_at in Bid.objects.filter(auction_id=auction_id)
+        .order_by('-amount')
+        .values_list('amount', 'creator__username', 'created_at')[:RECENT_BIDS_LIMIT]
+    ]
+    prime_live_auction(
+        auction, bid_count=auction.bid_total, recent_bids=recent_bids, client=client)  # type:ignore
+    add_live_auction_ids([auction.id], client=client)
+    return True
+
+
+def add_live_auction_ids(auction_ids, client=None):
+    client = client or get_redis_client()
+    if auction_ids:
+        client.sadd(LIVE_AUCTION_IDS_KEY, *[str(auction_id) for auction_id in auction_ids])
+
+
+def close_live_auction(auction_id, final_state, client=None):
+    """Stop letting sockets watch the auction, later ones get `final_state` once instead."""
+    close_live_auctions({auction_id: final_state}, client=client)
+
+
+def close_live_auctions(final_states, client=None):
+    """`close_live_auction` for every auction id to final state in `final_states`, in one round trip."""
+    client = client or get_redis_client()
+    if not final_states:
+        return
+    pipe = client.pipeline(transaction=False)
+    pipe.srem(LIVE_AUCTION_IDS_KEY, *[str(auction_id) for auction_id in final_states])
+    for auction_id, final_state in final_states.items():
+        pipe.set(FINAL_STATE_KEY.format(auction_id=auction_id), json.dumps(final_state), ex=FINAL_STATE_TTL)
+    pipe.execute()
+
+
+def get_watch_states(auction_ids, client=None) -> dict[str, tuple[bool, dict | None]]:
+    """
+    Maps each auction id to ``(live, final_state)`` with one round trip and no
+    database access. Auctions that are neither live nor recently closed map
+    to ``(False, None)``.
+    """
+    client = client or get_redis_client()
+    auction_ids = [str(auction_id) for auction_id in auction_ids]
+    pipe = client.pipeline(transaction=False)
+    for auction_id in auction_ids:
+        pipe.sismember(LIVE_AUCTION_IDS_KEY, auction_id)
+        pipe.get(FINAL_STATE_KEY.format(auction_id=auction_id))
+    replies = pipe.execute()
+    return {
+        auction_id: (bool(is_live), json.loads(final_state) if final_state else None)
+        for auction_id, is_live, final_state in zip(auction_ids, replies[::2], replies[1::2])
+    }
+
+
+def refresh_live_auction_ids(client=None) -> tuple[int, int]:
+    """
+    Reconcile the live id set with Postgres, returns how many ids were added
+    and removed. Ids are only added to the set once their auction committed,
+    so reading the set before querying means every member is visible to the
+    query and one added in between is never dropped as stale.
+    """
+    from .models import Auction
+
+    client = client or get_redis_client()
+    members = {_decode(member) for member in client.smembers(LIVE_AUCTION_IDS_KEY)}
+    ongoing = {str(auction_id) for auction_id in Auction.objects.filter(
+        ongoing=True).values_list('id', flat=True)}
+    stale = members - ongoing
+    missing = ongoing - members
+    pipe = client.pipeline(transaction=False)
+    if missing:
+        pipe.sadd(LIVE_AUCTION_IDS_KEY, *missing)
+    if stale:
+        pipe.srem(LIVE_AUCTION_IDS_KEY, *stale)
+    pipe.execute()
+    return len(missing), len(stale)
+
+
+def accept_bid(auction_id, amount, bidder=None, bid_id=None, user_id=None, now=None,
+               client=None) -> tuple[str, str, str]:
+    """
+    Atomically compare a bid against the live price and raise it when higher.
+    Returns ``(status, price, currency)`` where status is one of ACCEPTED,
+    TOO_LOW, INACTIVE or MISSING (no live record, caller should prime it).
+    An accepted bid becomes the top bid, see `get_top_bids`.
+    """
+    client = client or get_redis_client()
+    now = now or timezone.now()
+    top_bid = json.dumps({"bid_id": bid_id, "user_id": user_id, "amount": format_price(amount)})
+    status, price, currency = client.register_script(ACCEPT_BID_SCRIPT)(
+        keys=[live_auction_key(auction_id), recent_bids_key(auction_id)],
+        args=[
+            format_price(amount), now.timestamp(), top_bid, RECENT_BIDS_LIMIT,
+            format_price(amount), bid_entry(amount, bidder, now),
+        ],
+    )
+    return _decode(status), _decode(price), _decode(currency)
+
+
+def get_top_bids(auction_ids, client=None) -> dict[str, dict]:
+    """
+    The highest bid accepted in Redis of each auction that has one, as
+    ``{"bid_id", "user_id", "amount"}``, in one round trip. It may not be in
+    Postgres yet, bids accepted in Redis are written behind.
+    """
+    client = client or get_redis_client()
+    auction_ids = [str(auction_id) for auction_id in auction_ids]
+    pipe = client.pipeline(transaction=False)
+    for auction_id in auction_ids:
+        pipe.hget(live_auction_key(auction_id), 'top_bid')
+    return {
+        auction_id: json.loads(top_bid)
+        for auction_id, top_bid in zip(auction_ids, pipe.execute())
+        if top_bid is not None
+    }
+
+
+def check_bid(auction_id, amount, now=None, client=None) -> str:
+    """
+    Read-only version of `accept_bid`, used to reject bids that cannot win
+    before they are queued. A pass here is only a hint, the bid pipeline
+    still makes the final decision.
+    """
+    client = client or get_redis_client()
+    now = now or timezone.now()
+    price, start_ts, end_ts = client.hmget(
+        live_auction_key(auction_id), 'price', 'start_ts', 'end_ts')
+    if price is None:
+        return MISSING
+    if not float(start_ts) <= now.timestamp() <= float(end_ts):
+        return INACTIVE
+    if Decimal(format_price(amount)) <= Decimal(_decode(price)):
+        return TOO_LOW
+    return ACCEPTED
+
+
+def raise_live_price(auction_id, amount, recent_bids=(), bid_count=None, client=None) -> bool:
+    """
+    Record committed bids on the live record if it exists, raising the cached
+    price to `amount` if it is higher. `recent_bids` are `bid_entry` strings,
+    `bid_count` defaults to one bid per entry (or one without entries).
+    """
+    client = client or get_redis_client()
+    if bid_count is None:
+        bid_count = len(recent_bids) or 1
+    raised = client.register_script(RAISE_PRICE_SCRIPT)(
+        keys=[live_auction_key(auction_id), recent_bids_key(auction_id)],
+        args=[format_price(amount), bid_count, RECENT_BIDS_LIMIT, *_bid_args(recent_bids)],
+    )
+    return bool(raised)
+
+
+def append_event(auction_id, seq, frame, compact_frame, client=None):
+    """Keeps the frames of event `seq` for sockets that reconnect after missing it."""
+    append_events([(auction_id, seq, frame, compact_frame)], client=client)
+
+
+def append_events(events, client=None):
+    """`append_event` for many ``(auction_id, seq, frame, compact_frame)`` events in one round trip."""
+    client = client or get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    for auction_id, seq, frame, compact_frame in events:
+        stream_key = EVENT_STREAM_KEY.format(auction_id=auction_id)
+        pipe.xadd(stream_key, {'frame': frame, 'compact': compact_frame}, id=f"{seq}-0",
+                  maxlen=EVENT_STREAM_LENGTH, approximate=True)
+        pipe.pexpire(stream_key, EVENT_TTL_MS)
+    try:
+        pipe.execute()
+    except Exception as e:
+        # only replay suffers, the events themselves still go out
+        logger.error(f"Error appending {len(events)} auction events: {e}")
+
+
+def read_events_since(auction_id, since, client=None) -> list[tuple[int, str, bytes]] | None:
+    """
+    The ``(seq, frame, compact_frame)`` events after `since`, oldest first.
+    None if some of them are no longer kept, the caller needs a snapshot then.
+    """
+    client = client or get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    pipe.get(EVENT_SEQUENCE_KEY.format(auction_id=auction_id))
+    pipe.xrange(EVENT_STREAM_KEY.format(auction_id=auction_id), min=f"{since + 1}-0")
+    current, entries = pipe.execute()
+    current = int(current or 0)
+    if since == current:
+        return []
+    events = [
+        (int(_decode(entry_id).split('-')[0]), _decode(fields[b'frame']), fields[b'compact'])
+        for entry_id, fields in entries
+    ]
+    if since > current or not events or events[0][0] != since + 1:
+        return None
+    return events
+
+
+def claim_due(key, now, limit, client=None) -> list[str]:
+    """Takes up to `limit` members of a time-scored sorted set that are due by `now` off it."""
+    client = client or get_redis_client()
+    due = client.register_script(CLAIM_DUE_SCRIPT)(keys=[key], args=[now.timestamp(), limit])
+    return [_decode(member) for member in due]
+
+
+def seconds_until_due(key, client=None) -> float | None:
+    """How long until the earliest member of a time-scored sorted set is due, None if it is empty."""
+    client = client or get_redis_client()
+    first = client.zrange(key, 0, 0, withscores=True)
+    if not first:
+        return None
+    return max(first[0][1] - timezone.now().timestamp(), 0.0)
+
+
+def take_bid_slot(user_id, limit, client=None) -> bool:
+    """Counts a websocket bid of the user in the current second, False once there were more than `limit`."""
+    client = client or get_redis_client()
+    key = BID_RATE_KEY.format(user_id=user_id, second=int(time.time()))
+    pipe = client.pipeline(transaction=False)
+    pipe.incr(key)
+    pipe.expire(key, 2)
+    count, _ = pipe.execute()
+    return count <= limit
+
+
+def _viewer_keys(auction_id, now=None) -> list[str]:
+    window = int((now or time.time()) // VIEWER_WINDOW_SECONDS)
+    return [VIEWERS_KEY.format(auction_id=auction_id, window=w) for w in (window, window - 1)]
+
+
+def mark_watching(auction_ids, viewer, client=None):
+    """Counts `viewer`, a socket's channel name, as watching the auctions for this window."""
+    client = client or get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    for auction_id in auction_ids:
+        key = _viewer_keys(auction_id)[0]
+        pipe.pfadd(key, viewer)
+        pipe.expire(key, 3 * VIEWER_WINDOW_SECONDS)
+    pipe.execute()
+
+
+def count_viewers(auction_id, client=None) -> int:
+    """Approximate number of sockets that watched the auction in the last window or two."""
+    client = client or get_redis_client()
+    return client.pfcount(*_viewer_keys(auction_id))
+
+
+def get_snapshot(auction_id, client=None) -> dict | None:
+    """
+    Current state of a live auction straight from Redis: price, currency,
+    end time, bid count, the highest bids and how many are watching, with the
+    number of the last event sent to the auction. None if there is no record.
+    """
+    client = client or get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(live_auction_key(auction_id))
+    pipe.zrevrange(recent_bids_key(auction_id), 0, RECENT_BIDS_LIMIT - 1)
+    pipe.get(EVENT_SEQUENCE_KEY.format(auction_id=auction_id))
+    pipe.pfcount(*_viewer_keys(auction_id))
+    state, recent_bids, seq, viewers = pipe.execute()
+    if not state:
+        return None
+    state = {_decode(field): _decode(value) for field, value in state.items()}
+    return {
+        "auction_id": str(auction_id),
+        "price": state['price'],
+        "currency": state['currency'],
+        "end_time": datetime.fromtimestamp(float(state['end_ts']), tz=dt_timezone.utc).isoformat(),
+        "bid_count": int(state['bid_count']),
+        "recent_bids": [json.loads(entry) for entry in recent_bids],
+        "viewers": viewers,
+        "seq": int(seq or 0),
+    }
+
+
+def _decode(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
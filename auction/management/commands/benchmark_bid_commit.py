@@ -0,0 +1,99 @@
+import statistics
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from auction import live
+from auction.models import Auction, AuctionItem
+from auction.tasks import _process_bid_optimistically, _process_bid_with_lock
+
+User = get_user_model()
+
+BID_PATHS = {
+    'lock': _process_bid_with_lock,
+    'optimistic': _process_bid_optimistically,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the locked and the optimistic bid commit paths by having "
+        "several threads bid on one auction at the same time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help="Concurrent bidders on the auction")
+        parser.add_argument('--bids', type=int, default=50,
+                            help="Bids placed by each bidder")
+        parser.add_argument('--paths', nargs='+', choices=list(BID_PATHS), default=list(BID_PATHS))
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            self.run_path(path, options['threads'], options['bids'])
+
+    def run_path(self, path, thread_count, bids_per_thread):
+        run_id = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(
+                username=f"bench_{run_id}_{n}", email=f"bench_{run_id}_{n}@example.com")
+            for n in range(thread_count)
+        ]
+        item = AuctionItem.objects.create(
+            creator=users[0],
+            item_name=f"Benchmark item {run_id}",
+            details="Created by benchmark_bid_commit",
+            auction_start_date=timezone.now() - timedelta(minutes=1),
+            auction_end_date=timezone.now() + timedelta(hours=1),
+            initial_price=1,
+        )
+        auction = Auction.objects.create(
+            item_for_sale=item, current_price=item.initial_price, ongoing=True)
+
+        commit_bid = BID_PATHS[path]
+        latencies = []
+        outcomes = []
+        barrier = threading.Barrier(thread_count)
+
+        def bidder(n, user_id):
+            barrier.wait()
+            try:
+                for i in range(bids_per_thread):
+                    # bidders interleave their amounts so most bids race each other
+                    amount = float(2 + i * thread_count + n)
+                    started = time.perf_counter()
+                    outcomes.append(commit_bid(str(user_id), str(auction.id), amount))
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=bidder, args=(n, user.id)) for n, user in enumerate(users)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        auction.refresh_from_db()
+        accepted = outcomes.count("Bid processed successfully.")
+        latencies.sort()
+        self.stdout.write(
+            f"{path:>10}: {len(outcomes)} bids in {elapsed:.2f}s "
+            f"({len(outcomes) / elapsed:.0f} bids/s), {accepted} accepted, "
+            f"p50 {statistics.median(latencies) * 1000:.1f}ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms, "
+            f"final price {auction.current_price}"
+        )
+
+        live.get_redis_client().delete(live.live_auction_key(auction.id))
+        AuctionItem.objects.filter(id=item.id).delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import time
+
+import msgpack
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from auction import compact
+from auction.broadcaster import encode_frame
+from auction.consumers import AuctionConsumer
+
+
+async def forward_message(consumer, event):
+    """How consumers handled updates before frames were encoded by the producer."""
+    await consumer.send(text_data=json.dumps({
+        'type': 'auction_update',
+        'data': event['message']
+    }))
+
+
+def message_event(message):
+    return {"type": "auction.update", "message": message}
+
+
+def frame_event(message):
+    return {"type": "auction.update", "frame": encode_frame('auction_update', message)}
+
+
+def compact_event(message):
+    previous = {**message, "new_price": "1500.00", "bidder": "other_user"}
+    return {
+        "type": "auction.update",
+        "auction_id": message["auction_id"],
+        "seq": message["seq"],
+        "compact": compact.encode_update(message),
+        "compact_delta": compact.encode_delta(message, previous),
+    }
+
+
+# name: (event builder, consumer handler, compact subprotocol)
+STRATEGIES = {
+    'per-socket': (message_event, forward_message, False),
+    'pre-encoded': (frame_event, AuctionConsumer.auction_update, False),
+    'compact': (compact_event, AuctionConsumer.auction_update, True),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU spent delivering one auction update to every watcher of an "
+        "auction, with each socket encoding the message itself and with the frame "
+        "encoded once by the producer, as JSON and as compact delta frames. Every "
+        "delivery also goes through the msgpack round trip the Redis channel layer "
+        "does per channel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watchers', type=int, nargs='+', default=[100, 1000, 10000])
+        parser.add_argument('--broadcasts', type=int, default=20,
+                            help="Broadcasts measured for each watcher count")
+
+    def handle(self, *args, **options):
+        message = {
+            "new_price": "1550.75",
+            "currency": "Dollars",
+            "bidder": "some_user",
+            "timestamp": timezone.now().isoformat(),
+            "bid_count": 3,
+            "auction_id": "9f1c2d3e-0000-4000-8000-000000000000",
+            "seq": 42,
+        }
+        self.stdout.write(f"{'watchers':>9} " + " ".join(f"{name:>22}" for name in STRATEGIES))
+        frame_sizes = {}
+        for watchers in options['watchers']:
+            cpu = {}
+            for name, strategy in STRATEGIES.items():
+                cpu[name], frame_sizes[name] = asyncio.run(
+                    self.measure(watchers, options['broadcasts'], message, *strategy))
+            self.stdout.write(f"{watchers:>9} " + " ".join(
+                f"{seconds * 1000:>9.2f}ms/broadcast".rjust(22) for seconds in cpu.values()))
+        self.stdout.write(f"{'bytes':>9} " + " ".join(
+            f"{size:>16}/frame".rjust(22) for size in frame_sizes.values()))
+
+    async def measure(self, watchers, broadcasts, message, build_event, handle_event, compact_socket):
+        """Average CPU seconds per broadcast to `watchers` sockets and the size of the frame they got."""
+        sent = []
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            sent.append(text_data if bytes_data is None else bytes_data)
+
+        consumers = []
+        for _ in range(watchers):
+            consumer = AuctionConsumer()
+            consumer.send = send  # type:ignore
+            consumer.compact = compact_socket
+            consumers.append(consumer)
+
+        frame_size = 0
+        started = time.process_time()
+        for _ in range(broadcasts):
+            event = build_event(message)
+            for consumer in consumers:
+                # every socket has seen the previous update, so compact ones get the delta
+                consumer.last_seqs = {}
+                consumer.delta_bases = {message["auction_id"]: message["seq"] - 1}
+                delivered = msgpack.unpackb(msgpack.packb(event, use_bin_type=True), raw=False)
+                await handle_event(consumer, delivered)
+            frame_size = len(sent[-1])
+            sent.clear()
+        return (time.process_time() - started) / broadcasts, frame_size
@@ -0,0 +1,83 @@
+import asyncio
+import gc
+import time
+import tracemalloc
+import uuid
+
+from channels.auth import AuthMiddlewareStack
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from auction import live
+from auction.routing import watch_urlpatterns, websocket_urlpatterns
+
+
+async def accept_only(scope, receive, send):
+    """Accepts and idles, what the harness itself costs per socket."""
+    await receive()
+    await send({'type': 'websocket.accept'})
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
+
+
+# name: (application, path), the consumer goes through the auth middleware like in bidlord.asgi
+ENDPOINTS = {
+    'baseline': (lambda: accept_only, "/ws/"),
+    'consumer': (lambda: AuthMiddlewareStack(URLRouter(websocket_urlpatterns)), "/ws/auctions/{auction_id}/"),
+    'read-only': (lambda: URLRouter(watch_urlpatterns), "/ws/watch/{auction_id}/"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the memory and connect cost of idle anonymous watchers on the "
+        "AuctionConsumer endpoint and on the read-only watch endpoint. Sockets are "
+        "opened in process against the in-memory channel layer. Memory is what stays "
+        "allocated per connected socket and includes the test harness, the baseline row "
+        "is the harness alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        auction_id = str(uuid.uuid4())
+        live.add_live_auction_ids([auction_id])
+        try:
+            with override_settings(CHANNEL_LAYERS={
+                "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+            }):
+                channel_layers.backends.clear()
+                self.stdout.write(f"{'endpoint':>10} {'bytes/socket':>14} {'connect':>12}")
+                for name, (build_application, path) in ENDPOINTS.items():
+                    memory, connect = asyncio.run(self.measure(
+                        build_application(), path.format(auction_id=auction_id), options['sockets']))
+                    self.stdout.write(f"{name:>10} {memory:>14,.0f} {connect * 1000:>10.3f}ms")
+                channel_layers.backends.clear()
+        finally:
+            live.get_redis_client().srem(live.LIVE_AUCTION_IDS_KEY, auction_id)
+            live.get_redis_client().delete(*live._viewer_keys(auction_id))
+
+    async def measure(self, application, path, sockets):
+        """Bytes held and seconds spent connecting, per socket."""
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        communicators = []
+        started = time.perf_counter()
+        for _ in range(sockets):
+            communicator = WebsocketCommunicator(application, path)
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError(f"Could not connect to {path}")
+            communicators.append(communicator)
+        connect = (time.perf_counter() - started) / sockets
+        gc.collect()
+        memory = (tracemalloc.get_traced_memory()[0] - before) / sockets
+        tracemalloc.stop()
+        for communicator in communicators:
+            await communicator.disconnect()
+        return memory, connect
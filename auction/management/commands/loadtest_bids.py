@@ -0,0 +1,244 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from celery import current_app
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from auction import live, metrics, phases, results, scheduler
+from auction.models import Auction, AuctionItem
+from auction.tasks import submit_bid
+
+User = get_user_model()
+
+DISTRIBUTIONS = ('uniform', 'hotkey', 'sniping')
+MODES = ('lock', 'redis', 'batch', 'optimistic')
+# share of bids going to the hottest auction with the hotkey distribution
+HOT_AUCTION_SHARE = 0.9
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def format_ms(seconds):
+    return "n/a" if seconds is None else f"{seconds * 1000:.1f}ms"
+
+
+class Command(BaseCommand):
+    help = (
+        "Closed-loop load test of the bid pipeline: N synthetic users bid on M "
+        "auctions through submit_bid, each waiting for the result of its bid "
+        "before placing the next, and the run reports throughput and latencies. "
+        "Lock wait and broadcast send times are measured inside the tasks, so they "
+        "are only collected with --in-process. With sniping the auctions end during "
+        "the run, keep run_auction_scheduler running to race closing against the bids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--auctions', type=int, default=5)
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help="Length of the run in seconds")
+        parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform',
+                            help="uniform, hotkey (most bids on one auction) or sniping "
+                                 "(everyone bids in the last part of the run)")
+        parser.add_argument('--snipe-window', type=float, default=2.0,
+                            help="Seconds before the end of the run in which snipers bid, "
+                                 "the auctions end halfway through it")
+        parser.add_argument('--mode', choices=MODES,
+                            help="Bid acceptance mode, defaults to BID_ACCEPTANCE_MODE")
+        parser.add_argument('--think-ms', type=float, default=0.0,
+                            help="Pause between a result and the user's next bid")
+        parser.add_argument('--result-timeout', type=float, default=10.0)
+        parser.add_argument('--in-process', action='store_true',
+                            help="Run Celery tasks eagerly and use the in-memory channel "
+                                 "layer instead of workers and Redis pub/sub")
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['mode']:
+            overrides['BID_ACCEPTANCE_MODE'] = options['mode']
+        if options['in_process']:
+            overrides['CHANNEL_LAYERS'] = {
+                'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = options['in_process']
+        try:
+            with override_settings(**overrides):
+                self.run(options)
+        finally:
+            current_app.conf.task_always_eager = always_eager
+
+    def run(self, options):
+        self.outcomes_lock = threading.Lock()
+        run_id = uuid.uuid4().hex[:8]
+        users, auction_ids = [], []
+        timings = defaultdict(list)
+        outcomes = Counter()
+        stop = threading.Event()
+        listener = None
+        # whatever fails, the fixtures go, the scheduler would close them later otherwise
+        try:
+            self.create_fixtures(run_id, options, users, auction_ids)
+            metrics.install_collector(lambda metric, seconds: timings[metric].append(seconds))
+            if not isinstance(get_channel_layer(), InMemoryChannelLayer):
+                listener = threading.Thread(
+                    target=lambda: asyncio.run(self.listen(auction_ids, timings, stop)))
+                listener.start()
+                time.sleep(0.5)
+
+            started = time.monotonic()
+            deadline = started + options['duration']
+            if options['distribution'] == 'sniping':
+                # bids keep coming after the end, so they race the end of the auction
+                self.end_auctions_at(auction_ids, timezone.now() + timedelta(
+                    seconds=options['duration'] - options['snipe_window'] / 2))
+            bidders = [
+                threading.Thread(target=self.bidder, args=(
+                    user.id, auction_ids, deadline, options, timings, outcomes))
+                for user in users
+            ]
+            for bidder in bidders:
+                bidder.start()
+            for bidder in bidders:
+                bidder.join()
+            elapsed = time.monotonic() - started
+        finally:
+            stop.set()
+            if listener is not None:
+                listener.join()
+            metrics.install_collector(None)
+            self.remove_fixtures(users, auction_ids)
+        self.report(options, elapsed, outcomes, timings)
+
+    def create_fixtures(self, run_id, options, users, auction_ids):
+        """Fills `users` and `auction_ids` as it goes, so a failure halfway still leaves them to remove."""
+        for n in range(options['users']):
+            users.append(User.objects.create_user(
+                username=f"load_{run_id}_{n}", email=f"load_{run_id}_{n}@example.com"))
+        for n in range(options['auctions']):
+            item = AuctionItem.objects.create(
+                creator=users[0],
+                item_name=f"Load test item {run_id} {n}",
+                details="Created by loadtest_bids",
+                auction_start_date=timezone.now() - timedelta(minutes=1),
+                auction_end_date=timezone.now() + timedelta(seconds=options['duration'] + 60),
+                initial_price=1,
+            )
+            auction = Auction.objects.create(
+                item_for_sale=item, current_price=item.initial_price, ongoing=True)
+            auction_ids.append(str(auction.id))
+            live.prime_live_auction(auction)
+
+    def end_auctions_at(self, auction_ids, ends_at):
+        """Moves the end of the auctions, saving the items moves it in Redis and for the closer too."""
+        for item in AuctionItem.objects.filter(auction__id__in=auction_ids):
+            item.auction_end_date = ends_at
+            item.save(update_fields=['auction_end_date', 'updated_at'])
+
+    def remove_fixtures(self, users, auction_ids):
+        items = AuctionItem.objects.filter(creator__in=users)
+        item_ids = [str(item_id) for item_id in items.values_list('id', flat=True)]
+        redis_client = live.get_redis_client()
+        if auction_ids:
+            redis_client.delete(*[live.live_auction_key(a) for a in auction_ids])
+            redis_client.zrem(scheduler.AUCTION_ENDINGS_KEY, *auction_ids)
+            redis_client.zrem(phases.PHASE_TIMERS_KEY, *[
+                f"{auction_id}:{phase}"
+                for auction_id in auction_ids for phase in (phases.STARTED, phases.ENDING_SOON, phases.ENDED)])
+        if item_ids:
+            redis_client.zrem(scheduler.AUCTION_SCHEDULE_KEY, *item_ids)
+        items.delete()
+        User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def pick_auction(self, auction_ids, distribution):
+        if distribution == 'hotkey' and random.random() < HOT_AUCTION_SHARE:
+            return auction_ids[0]
+        return random.choice(auction_ids)
+
+    def bidder(self, user_id, auction_ids, deadline, options, timings, outcomes):
+        redis_client = live.get_redis_client()
+        snipe_from = deadline - options['snipe_window']
+        try:
+            while time.monotonic() < deadline:
+                if options['distribution'] == 'sniping' and time.monotonic() < snipe_from:
+                    time.sleep(min(0.05, snipe_from - time.monotonic()))
+                    continue
+                auction_id = self.pick_auction(auction_ids, options['distribution'])
+                price = redis_client.hget(live.live_auction_key(auction_id), 'price')
+                amount = float(price) + random.randint(1, 5)
+
+                submitted = time.perf_counter()
+                verdict, bid_id = submit_bid(str(user_id), auction_id, amount)
+                if verdict != live.ACCEPTED:
+                    with self.outcomes_lock:
+                        outcomes['fast_rejected'] += 1
+                    continue
+                status = self.wait_for_result(bid_id, options['result_timeout'])
+                with self.outcomes_lock:
+                    outcomes[status] += 1
+                if status == results.ACCEPTED:
+                    timings['accept'].append(time.perf_counter() - submitted)
+                if options['think_ms']:
+                    time.sleep(options['think_ms'] / 1000)
+        finally:
+            connection.close()
+
+    def wait_for_result(self, bid_id, timeout):
+        give_up_at = time.monotonic() + timeout
+        while time.monotonic() < give_up_at:
+            bid_result = results.get_bid_result(bid_id)
+            if bid_result and bid_result['status'] != results.PENDING:
+                return bid_result['status']
+            time.sleep(0.001)
+        return 'timed_out'
+
+    async def listen(self, auction_ids, timings, stop):
+        """Subscribes like a websocket client would and measures how late updates arrive."""
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()  # type:ignore
+        for auction_id in auction_ids:
+            await channel_layer.group_add(f"auction_{auction_id}", channel)  # type:ignore
+        while not stop.is_set():
+            try:
+                event = await asyncio.wait_for(channel_layer.receive(channel), timeout=0.5)  # type:ignore
+            except asyncio.TimeoutError:
+                continue
+            if event.get('type') != 'auction.update':
+                continue
+            sent_at = json.loads(event['frame'])['data'].get('timestamp')
+            if sent_at:
+                lag = timezone.now() - datetime.fromisoformat(sent_at)
+                timings['broadcast_lag'].append(lag.total_seconds())
+        for auction_id in auction_ids:
+            await channel_layer.group_discard(f"auction_{auction_id}", channel)  # type:ignore
+
+    def report(self, options, elapsed, outcomes, timings):
+        completed = sum(outcomes.values())
+        self.stdout.write(
+            f"mode={options['mode'] or 'default'} distribution={options['distribution']} "
+            f"users={options['users']} auctions={options['auctions']} duration={elapsed:.1f}s"
+        )
+        self.stdout.write(
+            "outcomes: " + ", ".join(f"{name}={count}" for name, count in sorted(outcomes.items())))
+        self.stdout.write(f"throughput: {completed / elapsed:.1f} bids/s")
+        for metric in ('accept', 'lock_wait', 'broadcast', 'broadcast_lag'):
+            samples = timings.get(metric, [])
+            self.stdout.write(
+                f"{metric:>13}: n={len(samples)} p50={format_ms(percentile(samples, 0.5))} "
+                f"p99={format_ms(percentile(samples, 0.99))}"
+            )
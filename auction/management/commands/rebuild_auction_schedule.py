@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auction import scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Refill the auction start and end time sets in Redis from Postgres, for when "
+        "Redis was flushed or restored and scheduled auctions would otherwise never "
+        "start or close. Safe to run while the scheduler is up."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=scheduler.REBUILD_CHUNK_SIZE,
+                            help="Rows fetched per round trip and written per pipeline")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(items, auctions):
+            self.stdout.write(
+                f"{items} items to start, {auctions} auctions to close ({time.perf_counter() - started:.1f}s)")
+
+        items, auctions = scheduler.rebuild_schedule(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Scheduled {items} items and {auctions} auction endings in {time.perf_counter() - started:.2f}s"))
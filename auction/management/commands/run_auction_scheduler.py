@@ -0,0 +1,73 @@
+import logging
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from auction import phases, scheduler
+from auction.tasks import close_finished_auctions
+
+logger = logging.getLogger('auction')
+
+# pause after a failed pass, doubled while failures repeat, so an outage of
+# Redis or Postgres is not hammered
+ERROR_BACKOFF_SECONDS = 1.0
+MAX_ERROR_BACKOFF_SECONDS = 30.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Start scheduled auctions at their start second, close them at their end second "
+        "and send auction phase events (started, ending soon, ended) as they come due. Runs until stopped, sleeping "
+        "until the next item or timer is due; several schedulers can run side by side. "
+        "Items whose start passed without an auction, say while no scheduler ran, are "
+        "started on launch and then every --catch-up-interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-sleep', type=float, default=1.0,
+                            help="Longest nap in seconds, bounds how late a newly scheduled earlier item starts")
+        parser.add_argument('--rebuild-schedule', action='store_true',
+                            help="Refill the start and end time sets from Postgres before starting")
+        parser.add_argument('--catch-up-interval', type=float, default=300.0,
+                            help="Seconds between scans of Postgres for overdue items")
+
+    def handle(self, *args, **options):
+        if options['rebuild_schedule']:
+            call_command('rebuild_auction_schedule', stdout=self.stdout)
+        self.stdout.write("Waiting for scheduled auctions")
+        next_catch_up = time.monotonic()
+        failures = 0
+        while True:
+            # the loop outlives any single database connection
+            close_old_connections()
+            try:
+                next_catch_up = self.run_once(options, next_catch_up)
+                wait = scheduler.seconds_until_next_run()
+            except Exception:
+                # nothing else starts or closes auctions, so this keeps going, due
+                # items and timers stay where they are and are picked up next time
+                failures += 1
+                logger.exception(f"Auction scheduler pass failed, {failures} in a row")
+                time.sleep(min(ERROR_BACKOFF_SECONDS * 2 ** (failures - 1), MAX_ERROR_BACKOFF_SECONDS))
+                continue
+            failures = 0
+            time.sleep(options['max_sleep'] if wait is None else min(wait, options['max_sleep']))
+
+    def run_once(self, options, next_catch_up):
+        """One pass over everything due, returns when the next catch-up scan is due."""
+        if time.monotonic() >= next_catch_up:
+            started = scheduler.catch_up_overdue_auctions()
+            if started:
+                self.stdout.write(f"Caught up on {started} overdue auctions")
+            next_catch_up = time.monotonic() + options['catch_up_interval']
+        started = scheduler.activate_due_auctions()
+        if started:
+            self.stdout.write(f"Started {started} auctions")
+        sent = phases.fire_due_timers()
+        if sent:
+            self.stdout.write(f"Sent {sent} phase events")
+        # after the phase events, so watchers hear that bidding ended before who won
+        close_finished_auctions()
+        return next_catch_up
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from auction import live
+from auction.outbox import WEBSOCKET_STATS_KEY, get_connection_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Show how many auction updates websockets skipped because their client was "
+        "behind, and how many connections were closed for lagging too far."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="Zero the counters after showing them")
+
+    def handle(self, *args, **options):
+        for name, value in get_connection_stats().items():
+            self.stdout.write(f"{name}: {value}")
+        if options['reset']:
+            live.get_redis_client().delete(WEBSOCKET_STATS_KEY)
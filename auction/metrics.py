@@ -0,0 +1,30 @@
+"""
+Timing hooks for the bid pipeline.
+
+Nothing is recorded unless a collector is installed, which the load test
+harness does for the length of its run.
+"""
+import time
+from contextlib import contextmanager
+
+_collector = None
+
+
+def install_collector(collector):
+    """`collector(metric, seconds)` is called for every recorded timing, pass None to remove it."""
+    global _collector
+    _collector = collector
+
+
+def record(metric, seconds):
+    if _collector is not None:
+        _collector(metric, seconds)
+
+
+@contextmanager
+def timed(metric):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(metric, time.perf_counter() - started)
@@ -1,7 +1,8 @@
 import uuid
 import logging
 from django.contrib.postgres.indexes import GinIndex
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED
 from django.contrib.auth import get_user_model
 from django.core.cache import cache 
 from django.contrib.postgres.search import SearchVector, SearchVectorField
@@ -96,14 +97,55 @@ class AuctionItem(TimeStampedModel, UUIDModel):
             GinIndex(fields=['search_vector']),
         ]
 
+    # fields feeding the start schedule, the end of a started auction and the
+    # search index, those are only maintained when one of them actually changes
+    SCHEDULE_FIELDS = ('auction_start_date',)
+    END_FIELDS = ('auction_end_date',)
+    SEARCH_FIELDS = ('item_name', 'details')
+
     def __str__(self) -> str:
         return f"{self.item_name} for sale :{self.auction_start_date} -> {self.auction_end_date} \
               -> {self.active_price} : {self.price_currency}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def has_changed(self, fields, update_fields=None) -> bool:
+        """Whether any of `fields` will be written with a value different from the one loaded"""
+        if update_fields is not None and not set(fields) & set(update_fields):
+            return False
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return True
+        return any(
+            loaded.get(field, DEFERRED) is DEFERRED or loaded[field] != getattr(self, field)
+            for field in fields
+        )
+
     def save(self, *args, **kwargs):
         if self._state.adding:
             self.active_price = self.initial_price
+        update_fields = kwargs.get('update_fields')
+        schedule_changed = self.has_changed(self.SCHEDULE_FIELDS, update_fields)
+        end_moved = not self._state.adding and self.has_changed(self.END_FIELDS, update_fields)
+        # read by the update_search_vector signal
+        self.search_fields_changed = self.has_changed(self.SEARCH_FIELDS, update_fields)
         super().save(*args, **kwargs)
+        written = [
+            field.attname for field in self._meta.concrete_fields
+            if update_fields is None or field.name in update_fields or field.attname in update_fields
+        ]
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{attname: getattr(self, attname) for attname in written},
+        }
+        if end_moved:
+            transaction.on_commit(self.move_auction_end, robust=True)
+        if not schedule_changed:
+            return
         try:
             redis_key = "auction_schedule"
             member = str(self.id)
@@ -112,6 +154,18 @@ class AuctionItem(TimeStampedModel, UUIDModel):
         except Exception as e:
             logger.error(f"Error adding auction item {self.id} to Redis sorted set: {e}")
 
+    def move_auction_end(self):
+        """Moves the end of the item's ongoing auction wherever Redis keeps it, bids and the closer read it there."""
+        from . import scheduler
+
+        auction_id = Auction.objects.filter(item_for_sale=self, ongoing=True).values_list('id', flat=True).first()
+        if auction_id is None:
+            return
+        try:
+            scheduler.move_auction_end(auction_id, self.auction_start_date, self.auction_end_date)
+        except Exception as e:
+            logger.error(f"Error moving the end of auction {auction_id} in Redis: {e}")
+
 
 class Auction(TimeStampedModel, UUIDModel):
     """Auctions are system created, not user created, based on the time specified on items"""
@@ -0,0 +1,86 @@
+"""
+Outbound queue of a websocket with "latest value wins" semantics.
+
+Group messages are handed to the outbox instead of being written straight to
+the socket, so the consumer takes them off the channel layer right away and
+its channel never fills up. Frames with the same key replace each other while
+they wait, a slow client therefore holds at most one pending update per
+auction and skips the intermediate ones, which are counted as dropped.
+"""
+import asyncio
+import itertools
+import time
+
+from . import live
+
+# connection stats shared by every consumer process
+WEBSOCKET_STATS_KEY = "websocket_stats"
+DROPPED_UPDATES = 'dropped_updates'
+LAGGING_DISCONNECTS = 'lagging_disconnects'
+
+
+class LatestValueOutbox:
+    def __init__(self):
+        # key -> (deliver coroutine function, queued at), in delivery order
+        self.pending = {}
+        self.dropped = 0
+        self.delivering_since = None
+        self._unique_keys = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def put(self, deliver, key=None):
+        """
+        Queue `deliver`, an argument-less coroutine function writing the frame.
+        A frame still waiting under the same key is replaced and counted as
+        dropped, frames without a key are always delivered.
+        """
+        if key is None:
+            key = ('unique', next(self._unique_keys))
+        queued_at = time.monotonic()
+        if key in self.pending:
+            self.dropped += 1
+            # the client is as far behind as the frame it never got
+            queued_at = self.pending[key][1]
+        self.pending[key] = (deliver, queued_at)
+        self._wakeup.set()
+
+    def lag(self) -> float:
+        """Seconds the oldest undelivered frame has been waiting, including one being written."""
+        waiting_since = [queued_at for _, queued_at in self.pending.values()]
+        if self.delivering_since is not None:
+            waiting_since.append(self.delivering_since)
+        if not waiting_since:
+            return 0.0
+        return time.monotonic() - min(waiting_since)
+
+    async def run(self):
+        """Writes queued frames in order until cancelled."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.pending:
+                key = next(iter(self.pending))
+                deliver, self.delivering_since = self.pending.pop(key)
+                try:
+                    await deliver()
+                finally:
+                    self.delivering_since = None
+
+
+def record_connection_stats(dropped, lagging, client=None):
+    """Adds the drops of a finished connection, and whether it was cut off for lagging, to the shared stats."""
+    client = client or live.get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    pipe.hincrby(WEBSOCKET_STATS_KEY, DROPPED_UPDATES, dropped)
+    if lagging:
+        pipe.hincrby(WEBSOCKET_STATS_KEY, LAGGING_DISCONNECTS, 1)
+    pipe.execute()
+
+
+def get_connection_stats(client=None) -> dict[str, int]:
+    client = client or live.get_redis_client()
+    stats = client.hgetall(WEBSOCKET_STATS_KEY)
+    return {
+        field: int(stats.get(field.encode(), 0))
+        for field in (DROPPED_UPDATES, LAGGING_DISCONNECTS)
+    }
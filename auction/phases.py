@@ -0,0 +1,102 @@
+"""
+Phase events pushed to auction watchers close to the exact second.
+
+When an auction is created its phase changes are put on a timer set in Redis,
+``auction_phase_timers``, scored by the second they are due. The auction
+scheduler (see `scheduler`) sleeps until the earliest one, claims everything
+due and sends it to the auction's group, so clients learn that an auction
+started, is about to end or has ended without polling and without anything
+scanning the Auction table.
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from . import broadcaster, live
+
+logger = logging.getLogger('auction')
+
+PHASE_TIMERS_KEY = "auction_phase_timers"
+CLAIM_BATCH_SIZE = 100
+
+STARTED = 'started'
+ENDING_SOON = 'ending_soon'
+ENDED = 'ended'
+ENDING_SOON_SECONDS = 60
+
+
+def schedule_phases(auction_id, starts_at, ends_at, client=None):
+    """
+    Puts the phase changes of an auction still ahead on the timer set. Timers
+    are keyed by auction and phase, scheduling again moves them.
+    """
+    client = client or live.get_redis_client()
+    timers = {
+        STARTED: starts_at,
+        ENDING_SOON: max(ends_at - timedelta(seconds=ENDING_SOON_SECONDS), starts_at),
+        ENDED: ends_at,
+    }
+    now = timezone.now()
+    due = {
+        f"{auction_id}:{phase}": fires_at.timestamp()
+        for phase, fires_at in timers.items()
+        if fires_at > now
+    }
+    if due:
+        client.zadd(PHASE_TIMERS_KEY, due)
+
+
+def phase_message(phase, ends_at, now) -> dict:
+    return {
+        "phase": phase,
+        "end_time": ends_at.isoformat(),
+        "seconds_left": max(round((ends_at - now).total_seconds()), 0),
+    }
+
+
+def announce_started(auctions, now=None, client=None):
+    """
+    Sends the started phase of auctions that were just started. They start at
+    their start second, when its timer can no longer be set, so it goes out
+    right away and for all of them at once.
+    """
+    now = now or timezone.now()
+    broadcaster.send_events('auction.phase', 'auction_phase', {
+        str(auction.id): phase_message(STARTED, auction.item_for_sale.auction_end_date, now)
+        for auction in auctions
+    }, client=client)
+
+
+def claim_due_timers(now=None, client=None) -> list[tuple[str, str]]:
+    """Takes a batch of the timers due by `now` off the set, as ``(auction_id, phase)``."""
+    due = live.claim_due(PHASE_TIMERS_KEY, now or timezone.now(), CLAIM_BATCH_SIZE, client=client)
+    return [tuple(member.rsplit(':', 1)) for member in due]
+
+
+def seconds_until_next_timer(client=None) -> float | None:
+    return live.seconds_until_due(PHASE_TIMERS_KEY, client=client)
+
+
+def fire_due_timers(now=None, client=None) -> int:
+    """Sends the phase events that are due, returns how many went out."""
+    client = client or live.get_redis_client()
+    now = now or timezone.now()
+    sent = 0
+    while timers := claim_due_timers(now, client=client):
+        # the end time comes from the live record, not from Postgres
+        pipe = client.pipeline(transaction=False)
+        for auction_id, _ in timers:
+            pipe.hget(live.live_auction_key(auction_id), 'end_ts')
+        for (auction_id, phase), end_ts in zip(timers, pipe.execute()):
+            message = {"phase": phase}
+            if end_ts is not None:
+                message = phase_message(phase, datetime.fromtimestamp(float(end_ts), tz=dt_timezone.utc), now)
+            try:
+                broadcaster.send_phase(auction_id, message, client=client)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Error sending {phase} phase of auction {auction_id}: {e}")
+        if len(timers) < CLAIM_BATCH_SIZE:
+            break
+    return sent
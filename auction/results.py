@@ -0,0 +1,75 @@
+"""
+Outcome of queued bids.
+
+Every queued bid gets an id, its outcome is kept in Redis for a short while so
+bidders can look it up cheaply, and is pushed to the bidder's own channel group.
+"""
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from . import compact, live
+from .broadcaster import encode_frame
+
+logger = logging.getLogger('auction')
+
+BID_RESULT_KEY = "bid_result:{bid_id}"
+BID_RESULT_TTL = 60 * 10
+
+PENDING = 'pending'
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+FAILED = 'failed'
+
+
+def bid_result_key(bid_id) -> str:
+    return BID_RESULT_KEY.format(bid_id=bid_id)
+
+
+def user_group_name(user_id) -> str:
+    return f"user_{user_id}"
+
+
+def build_bid_result(bid_id, user_id, auction_id, amount, status, detail="") -> dict:
+    return {
+        "bid_id": str(bid_id),
+        "user_id": str(user_id),
+        "auction_id": str(auction_id),
+        "amount": live.format_price(amount),
+        "status": status,
+        "detail": detail,
+    }
+
+
+def store_bid_results(bid_results, client=None):
+    client = client or live.get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    for result in bid_results:
+        pipe.set(bid_result_key(result['bid_id']), json.dumps(result), ex=BID_RESULT_TTL)
+    pipe.execute()
+
+
+def publish_bid_results(bid_results, client=None):
+    """Store final bid outcomes and push each one to its bidder."""
+    store_bid_results(bid_results, client=client)
+    channel_layer = get_channel_layer()
+    for result in bid_results:
+        try:
+            async_to_sync(channel_layer.group_send)(  # type:ignore
+                user_group_name(result['user_id']),
+                {
+                    "type": "bid.result",
+                    "frame": encode_frame('bid_result', result),
+                    "compact": compact.pack('bid_result', result),
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error pushing result of bid {result['bid_id']}: {e}")
+
+
+def get_bid_result(bid_id, client=None) -> dict | None:
+    client = client or live.get_redis_client()
+    raw = client.get(bid_result_key(bid_id))
+    return json.loads(raw) if raw else None
@@ -1,7 +1,13 @@
 from django.urls import re_path
-from . import consumers
+from . import consumers, watchers
 
 websocket_urlpatterns = [
     re_path(r'ws/auctions/(?P<auction_id>[0-9a-f-]+)/$',
             consumers.AuctionConsumer.as_asgi()),
+    re_path(r'ws/auctions/$', consumers.AuctionSubscriptionsConsumer.as_asgi()),
+]
+
+# read-only and anonymous, served without the session and auth middleware
+watch_urlpatterns = [
+    re_path(r'ws/watch/(?P<auction_id>[0-9a-f-]+)/$', watchers.watch_auction),
 ]
@@ -0,0 +1,245 @@
+"""
+Second-precise auction start scheduler.
+
+Auction items wait on the ``auction_schedule`` sorted set scored by their
+start time. The ``run_auction_scheduler`` process sleeps until the earliest
+item, end or phase timer is due, claims the items whose second has come and starts
+their auctions right then, in bulk: the Auction rows, the live records in
+Redis that bids and snapshots are served from, the phase timers, the
+watchable ids and the end times. Auctions are closed from the same loop as their end times
+come due and phase timers are sent from it too. Items whose start passed
+while no scheduler ran are caught up on from Postgres.
+"""
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import live, phases
+from .models import Auction, AuctionItem
+
+logger = logging.getLogger('auction')
+
+AUCTION_SCHEDULE_KEY = "auction_schedule"
+# ids of started auctions scored by their end time, popped by the closer
+AUCTION_ENDINGS_KEY = "auction_endings"
+ACTIVATION_BATCH_SIZE = 1000
+# items that failed to start are claimed again after this long
+ACTIVATION_RETRY_SECONDS = 5
+REBUILD_CHUNK_SIZE = 5000
+ZADD_BATCH_SIZE = 1000
+
+
+def activate_due_auctions(now=None, client=None) -> int:
+    """
+    Starts the auctions of every scheduled item that is due, returns how many
+    were started. Items that already ended, say because they were scheduled
+    while no scheduler ran, leave the schedule without an auction, as they do
+    in `catch_up_overdue_auctions`.
+    """
+    client = client or live.get_redis_client()
+    now = now or timezone.now()
+    started = 0
+    while item_ids := live.claim_due(AUCTION_SCHEDULE_KEY, now, ACTIVATION_BATCH_SIZE, client=client):
+        started += activate_items(
+            AuctionItem.available_items.filter(id__in=item_ids, auction__isnull=True, auction_end_date__gt=now),
+            client=client)
+        if len(item_ids) < ACTIVATION_BATCH_SIZE:
+            break
+    if started:
+        logger.info(f"Started {started} auctions")
+    return started
+
+
+def catch_up_overdue_auctions(now=None, client=None) -> int:
+    """
+    Starts every item still running that has no auction although its start
+    time passed, whether it was dropped from the schedule or no scheduler ran.
+    """
+    client = client or live.get_redis_client()
+    now = now or timezone.now()
+    item_ids = list(AuctionItem.available_items.filter(
+        auction__isnull=True,
+        auction_start_date__lte=now,
+        auction_end_date__gt=now,
+    ).values_list('id', flat=True))
+    started = 0
+    for first in range(0, len(item_ids), ACTIVATION_BATCH_SIZE):
+        started += activate_items(
+            AuctionItem.available_items.filter(
+                id__in=item_ids[first:first + ACTIVATION_BATCH_SIZE], auction__isnull=True),
+            client=client)
+    if item_ids:
+        logger.info(f"Caught up on {started} of {len(item_ids)} overdue auctions")
+    return started
+
+
+def activate_items(items, client=None) -> int:
+    """
+    Starts the auctions of `items` with one insert and one Redis round trip:
+    Auction rows, live records and phase timers, and their entries leave the
+    schedule. Once the auctions committed they become watchable and closable
+    and their started phase is sent, see `publish_started`. Returns how many
+    were started, items that already got an auction elsewhere are skipped.
+    """
+    client = client or live.get_redis_client()
+    items = list(items)
+    if not items:
+        return 0
+    auctions = [
+        Auction(item_for_sale=item, current_price=item.initial_price, ongoing=True)
+        for item in items
+    ]
+    try:
+        # a failure in Redis rolls the auctions back, so the retry starts them from scratch
+        with transaction.atomic():
+            Auction.objects.bulk_create(auctions, ignore_conflicts=True)
+            # rows that lost to an auction created concurrently were never inserted
+            inserted = set(Auction.objects.filter(
+                id__in=[auction.id for auction in auctions]).values_list('id', flat=True))
+            auctions = [auction for auction in auctions if auction.id in inserted]
+            pipe = client.pipeline(transaction=False)
+            for auction in auctions:
+                item = auction.item_for_sale
+                live.prime_live_auction(auction, client=pipe)
+                phases.schedule_phases(auction.id, item.auction_start_date, item.auction_end_date, client=pipe)
+            pipe.zrem(AUCTION_SCHEDULE_KEY, *[str(item.id) for item in items])
+            pipe.execute()
+            transaction.on_commit(lambda: publish_started(auctions, client=client), robust=True)
+    except Exception as e:
+        logger.error(f"Error starting auctions for {len(items)} items: {e}")
+        retry_at = timezone.now() + timedelta(seconds=ACTIVATION_RETRY_SECONDS)
+        client.zadd(AUCTION_SCHEDULE_KEY, {str(item.id): retry_at.timestamp() for item in items})
+        return 0
+    return len(auctions)
+
+
+def publish_started(auctions, client=None):
+    """
+    Adds committed auctions to the watchable ids and the end time set and
+    sends their started phase. Only ever called after commit, the reconcilers
+    rely on ids being added once their auction is visible in Postgres. If it
+    fails they add the auctions on their next run.
+    """
+    client = client or live.get_redis_client()
+    if not auctions:
+        return
+    pipe = client.pipeline(transaction=False)
+    live.add_live_auction_ids([auction.id for auction in auctions], client=pipe)
+    pipe.zadd(AUCTION_ENDINGS_KEY, {
+        str(auction.id): auction.item_for_sale.auction_end_date.timestamp() for auction in auctions})
+    pipe.execute()
+    phases.announce_started(auctions, client=client)
+
+
+def move_auction_end(auction_id, starts_at, ends_at, client=None):
+    """Moves the end of an ongoing auction in the end time set, its live record and its phase timers."""
+    client = client or live.get_redis_client()
+    pipe = client.pipeline(transaction=False)
+    pipe.zadd(AUCTION_ENDINGS_KEY, {str(auction_id): ends_at.timestamp()})
+    live.move_live_end(auction_id, ends_at, client=pipe)
+    phases.schedule_phases(auction_id, starts_at, ends_at, client=pipe)
+    pipe.execute()
+
+
+def requeue_open_auctions(auction_ids, client=None) -> int:
+    """
+    Puts claimed auctions that are still open back on the end time set at
+    their current end, say because it was moved after they were scheduled.
+    Returns how many were put back.
+    """
+    client = client or live.get_redis_client()
+    endings = {
+        str(auction_id): end_date.timestamp()
+        for auction_id, end_date in Auction.objects.filter(id__in=auction_ids, ongoing=True).values_list(
+            'id', 'item_for_sale__auction_end_date')
+    }
+    if endings:
+        client.zadd(AUCTION_ENDINGS_KEY, endings)
+    return len(endings)
+
+
+def seconds_until_next_run(client=None) -> float | None:
+    """Time until the next item start, auction end or phase timer is due, None if nothing is scheduled."""
+    waits = [
+        wait for wait in (
+            live.seconds_until_due(AUCTION_SCHEDULE_KEY, client=client),
+            live.seconds_until_due(AUCTION_ENDINGS_KEY, client=client),
+            phases.seconds_until_next_timer(client=client),
+        )
+        if wait is not None
+    ]
+    return min(waits, default=None)
+
+
+def reconcile_auction_endings(client=None) -> tuple[int, int]:
+    """
+    Repairs the end time set against Postgres, returns how many auctions were
+    added or moved and how many stale ids were removed. The set is read
+    before querying, like `live.refresh_live_auction_ids`, so an auction
+    started in between is left alone.
+    """
+    client = client or live.get_redis_client()
+    members = {
+        live._decode(member): score
+        for member, score in client.zrange(AUCTION_ENDINGS_KEY, 0, -1, withscores=True)
+    }
+    ongoing = {
+        str(auction_id): end_date.timestamp()
+        for auction_id, end_date in Auction.objects.filter(ongoing=True).values_list(
+            'id', 'item_for_sale__auction_end_date')
+    }
+    drifted = {
+        auction_id: end_ts for auction_id, end_ts in ongoing.items() if members.get(auction_id) != end_ts
+    }
+    stale = members.keys() - ongoing.keys()
+    pipe = client.pipeline(transaction=False)
+    if drifted:
+        pipe.zadd(AUCTION_ENDINGS_KEY, drifted)
+    if stale:
+        pipe.zrem(AUCTION_ENDINGS_KEY, *stale)
+    pipe.execute()
+    return len(drifted), len(stale)
+
+
+def rebuild_schedule(chunk_size=REBUILD_CHUNK_SIZE, progress=None, client=None) -> tuple[int, int]:
+    """
+    Refills the start and end time sets from Postgres, say after Redis was
+    flushed, returns how many items and auctions were added. Rows are streamed
+    with a server side cursor and each chunk is written in one pipeline,
+    `progress` is called with the running totals after each one. Entries are
+    only added, so anything scheduled meanwhile stays.
+    """
+    client = client or live.get_redis_client()
+    unstarted = AuctionItem.available_items.filter(
+        auction__isnull=True,
+        auction_end_date__gt=timezone.now(),
+    ).values_list('id', 'auction_start_date')
+    ongoing = Auction.objects.filter(ongoing=True).values_list('id', 'item_for_sale__auction_end_date')
+    totals = [0, 0]
+    for index, (key, rows) in enumerate(((AUCTION_SCHEDULE_KEY, unstarted), (AUCTION_ENDINGS_KEY, ongoing))):
+        chunk = {}
+        for row_id, scheduled_at in rows.iterator(chunk_size=chunk_size):
+            chunk[str(row_id)] = scheduled_at.timestamp()
+            if len(chunk) == chunk_size:
+                totals[index] += _add_chunk(client, key, chunk)
+                chunk = {}
+                if progress:
+                    progress(*totals)
+        totals[index] += _add_chunk(client, key, chunk)
+        if progress:
+            progress(*totals)
+    return totals[0], totals[1]
+
+
+def _add_chunk(client, key, members) -> int:
+    """Adds a chunk of members in one round trip, split over ZADDs small enough not to stall Redis."""
+    if not members:
+        return 0
+    items = list(members.items())
+    pipe = client.pipeline(transaction=False)
+    for first in range(0, len(items), ZADD_BATCH_SIZE):
+        pipe.zadd(key, dict(items[first:first + ZADD_BATCH_SIZE]))
+    pipe.execute()
+    return len(items)
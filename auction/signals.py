@@ -1,8 +1,10 @@
 import logging
 from django.db.models.signals import post_delete, post_save 
+from django.contrib.auth import get_user_model
 from django.contrib.postgres.search import SearchVector
 from django.core.cache import cache
 from django.dispatch import receiver
+from . import identity
 from .models import AuctionItem 
 
 logger = logging.getLogger('auction')
@@ -11,7 +13,7 @@ logger = logging.getLogger('auction')
 def remove_auction_from_redis(sender, instance, **kwargs):
     try:
         redis_key = "auction_schedule"
-        member = instance.id
+        member = str(instance.id)
         cache.client.get_client().zrem(redis_key, member)  # type:ignore
     except Exception as e:
         logger.error(f"Error removing auction item {instance.id} from Redis sorted set: {e}")
@@ -20,9 +22,44 @@ def remove_auction_from_redis(sender, instance, **kwargs):
 @receiver(post_save, sender=AuctionItem)
 def update_search_vector(sender, instance, **kwargs):
     """
-    Automatically update the search_vector field whenever an AuctionItem is saved.
+    Automatically update the search_vector field whenever an AuctionItem is saved
+    with a new name or details.
     """
+    if not getattr(instance, 'search_fields_changed', True):
+        return
     AuctionItem.objects.filter(pk=instance.pk).update(
         search_vector=SearchVector(
             'item_name', 'details', config='english')
     )
+
+
+@receiver(post_save, sender=get_user_model())
+def refresh_cached_username(sender, instance, **kwargs):
+    """Keep the cached display name in step with username changes."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    try:
+        identity.remember_username(instance.id, instance.username)
+    except Exception as e:
+        logger.error(f"Error caching username of user {instance.id}: {e}")
+
+
+@receiver(post_save, sender=get_user_model())
+def refresh_cached_active(sender, instance, **kwargs):
+    """Deactivated users stop being able to bid over websockets right away."""
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'is_active' not in update_fields:
+        return
+    try:
+        identity.remember_active(instance.id, instance.is_active)
+    except Exception as e:
+        logger.error(f"Error caching active flag of user {instance.id}: {e}")
+
+
+@receiver(post_delete, sender=get_user_model())
+def forget_deleted_user(sender, instance, **kwargs):
+    try:
+        identity.remember_active(instance.id, False)
+    except Exception as e:
+        logger.error(f"Error caching deletion of user {instance.id}: {e}")
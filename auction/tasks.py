@@ -1,152 +1,609 @@
+import json
 import logging
-from datetime import timedelta 
-from asgiref.sync import async_to_sync
+import time
+import uuid
+from decimal import Decimal
 
 from celery import shared_task 
-from channels.layers import get_channel_layer
-from django.contrib.auth import get_user_model
 from django.utils import timezone
-from django.db import IntegrityError, transaction 
+from django.db import IntegrityError, OperationalError, connection, transaction 
 from django.core.cache import cache
+from django.conf import settings
 
 
+from . import broadcaster, identity, live, metrics, results, scheduler
 from .models import AuctionItem, Auction , Bid
 
 logger = logging.getLogger('auction')
-User = get_user_model()
-
-@shared_task(name='create_pending_auctions_from_cache')
-def create_pending_auctions_from_cache():
-    """Create pending auctions from cached auction items."""
-    redis_key = 'auction_schedule'
-    redis_client = cache.client.get_client()  # type:ignore
-    now_ts = timezone.now().timestamp()
-    five_mins_later_ts = (timezone.now() + timedelta(minutes=5)).timestamp()
-
-    item_ids_to_start = redis_client.zrangebyscore(
-        redis_key, now_ts, five_mins_later_ts
+
+PENDING_BIDS_KEY = "pending_bids:{auction_id}"
+MATCHER_SCHEDULED_KEY = "bid_matcher_scheduled:{auction_id}"
+# bids accepted in Redis that could not be written to Postgres, kept for replay
+UNPERSISTED_BIDS_KEY = "unpersisted_bids"
+OPTIMISTIC_BID_ATTEMPTS = 3
+
+BID_ACCEPTED = "Bid processed successfully."
+BID_TOO_LOW = "Bid amount must be higher than current price."
+AUCTION_INACTIVE = "Auction does not exist or is not active."
+BID_FAILED = "Failed to process bid after multiple attempts."
+
+# Raises the price only if the bid is higher and the auction is live, and in
+# the same statement syncs the item price and records the bid. Concurrent
+# bidders queue on the auction row and the WHERE clause is re-checked against
+# the committed price, so no application lock is needed.
+COMMIT_BID_SQL = """
+WITH raised AS (
+    UPDATE {auction_table} AS a
+    SET current_price = %(amount)s, updated_at = %(now)s
+    FROM {item_table} AS i
+    WHERE a.id = %(auction_id)s
+      AND a.item_for_sale_id = i.id
+      AND a.ongoing
+      AND a.current_price < %(amount)s
+      AND i.auction_start_date <= %(now)s
+      AND i.auction_end_date >= %(now)s
+    RETURNING a.id, a.item_for_sale_id, i.price_currency
+), item AS (
+    UPDATE {item_table} AS i
+    SET active_price = %(amount)s, updated_at = %(now)s
+    FROM raised
+    WHERE i.id = raised.item_for_sale_id
+), bid AS (
+    INSERT INTO {bid_table} (id, created_at, updated_at, creator_id, auction_id, amount, is_deleted)
+    SELECT %(bid_id)s, %(now)s, %(now)s, %(user_id)s, raised.id, %(amount)s, false
+    FROM raised
+    RETURNING id
+)
+SELECT raised.price_currency FROM raised, bid
+"""
+
+CLOSE_BATCH_SIZE = 1000
+# Raises the given open auctions to the top bids accepted in Redis for them,
+# whose write-behind may still be queued, before they are closed.
+RAISE_TO_TOP_BIDS_SQL = """
+WITH top_bids AS (
+    SELECT * FROM unnest(%(auction_ids)s::uuid[], %(amounts)s::numeric[]) AS t(auction_id, amount)
+), raised AS (
+    UPDATE {auction_table} AS a
+    SET current_price = top_bids.amount, updated_at = %(now)s
+    FROM top_bids
+    WHERE a.id = top_bids.auction_id AND a.ongoing AND a.current_price < top_bids.amount
+    RETURNING a.item_for_sale_id, top_bids.amount
+)
+UPDATE {item_table} AS i
+SET active_price = raised.amount, updated_at = %(now)s
+FROM raised
+WHERE i.id = raised.item_for_sale_id
+"""
+# Locks the given auctions that are still open and past their end time. A bid
+# in flight holds its auction row, so this waits for it to commit first.
+LOCK_EXPIRED_AUCTIONS_SQL = """
+SELECT a.id
+FROM {auction_table} AS a
+JOIN {item_table} AS i ON i.id = a.item_for_sale_id
+WHERE a.id = ANY(%(auction_ids)s) AND a.ongoing AND i.auction_end_date < %(now)s
+FOR UPDATE OF a
+"""
+# Closes the locked auctions, each with the earliest of its highest bids as the
+# winner. Run as its own statement once the lock is held, so the winner is read
+# from the same committed bids as the final price.
+CLOSE_AUCTIONS_SQL = """
+WITH winners AS (
+    SELECT DISTINCT ON (b.auction_id) b.auction_id, b.creator_id
+    FROM {bid_table} AS b
+    WHERE b.auction_id = ANY(%(auction_ids)s::uuid[])
+    ORDER BY b.auction_id, b.amount DESC, b.created_at
+)
+UPDATE {auction_table} AS a
+SET ongoing = false, winner_id = winners.creator_id, updated_at = %(now)s
+FROM unnest(%(auction_ids)s::uuid[]) AS expired(id)
+LEFT JOIN winners ON winners.auction_id = expired.id
+WHERE a.id = expired.id
+RETURNING a.id, a.current_price, a.winner_id
+"""
+
+
+def submit_bid(user_id, auction_id, amount, bidder=None):
+    """
+    Entry point for bids from clients. Bids that cannot beat the live price
+    are rejected here without being queued, returns ``(verdict, bid_id)``
+    where bid_id is only set when the verdict is ``live.ACCEPTED``.
+    `bidder` is the display name broadcast with the bid, when the caller
+    knows it the pipeline does not need to look it up.
+    """
+    verdict = live.check_bid(auction_id, amount)
+    if verdict == live.MISSING and live.load_live_auction(auction_id):
+        verdict = live.check_bid(auction_id, amount)
+    if verdict != live.ACCEPTED:
+        return verdict, None
+    return verdict, enqueue_bid(user_id, auction_id, amount, bidder=bidder)
+
+
+def enqueue_bid(user_id, auction_id, amount, bidder=None):
+    """
+    Hands a bid to the bid pipeline and returns its id, which is also the id
+    of the Bid row if it gets accepted. In batch mode bids are parked on a
+    per-auction list and at most one matcher run is scheduled per auction,
+    every other mode processes bids one task at a time.
+    """
+    bid_id = str(uuid.uuid4())
+    redis_client = live.get_redis_client()
+    results.store_bid_results(
+        [results.build_bid_result(bid_id, user_id, auction_id, amount, results.PENDING)],
+        client=redis_client,
     )
-    if not item_ids_to_start:
-        logger.info("No auction items to start in the next 5 minutes.")
-        return
-    
-    items = AuctionItem.available_items.filter(
-        id__in = [item_id.decode('utf-8') for item_id in item_ids_to_start],
-        auction__isnull=True,
+    if settings.BID_ACCEPTANCE_MODE != 'batch':
+        process_bid.delay(  # type:ignore
+            user_id=user_id, auction_id=auction_id, amount=amount, bid_id=bid_id, bidder=bidder)
+        return bid_id
+
+    redis_client.rpush(
+        PENDING_BIDS_KEY.format(auction_id=auction_id),
+        json.dumps({
+            "bid_id": bid_id,
+            "user_id": user_id,
+            "bidder": bidder,
+            "amount": live.format_price(amount),
+        })
     )
+    scheduled = redis_client.set(
+        MATCHER_SCHEDULED_KEY.format(auction_id=auction_id), 1, nx=True, ex=30)
+    if scheduled:
+        match_pending_bids.delay(auction_id=auction_id)  # type:ignore
+    return bid_id
 
-    created_count = 0
-    for item in items:
-        try:
-            with transaction.atomic():
-                Auction.objects.create(
-                    item_for_sale=item,
-                    current_price=item.initial_price,
-                    ongoing=True
-                )
-                created_count += 1
-                logger.info(f"Created pending auction for item {item.id}")
-                redis_client.zrem(redis_key, str(item.id))
-        except Exception as e:
-            logger.error(f"Error creating auction for item {item.id}: {e}")
-    logger.info(f"Total pending auctions created: {created_count}")
-    return f"Total pending auctions created: {created_count}"
+@shared_task(name='refresh_live_auction_ids')
+def refresh_live_auction_ids():
+    """Reconcile the set of auction ids websockets may watch with Postgres."""
+    added, removed = live.refresh_live_auction_ids()
+    logger.info(f"Refreshed live auction ids, added {added} and removed {removed}")
+    return f"Added {added} and removed {removed} live auction ids."
+
+
+@shared_task(name='reconcile_auction_endings')
+def reconcile_auction_endings():
+    """Repair the end time set the closer pops from against Postgres."""
+    repaired, removed = scheduler.reconcile_auction_endings()
+    logger.info(f"Reconciled auction end times, repaired {repaired} and removed {removed}")
+    return f"Repaired {repaired} and removed {removed} auction end times."
 
 
 @shared_task(name='process_bid', bind=True, max_retries=3, default_retry_delay=5)
-def process_bid(self, user_id, auction_id, amount):
-    """Processes a single bid."""
-    lock_key = f"auction_lock:{auction_id}"
-    lock_timeout = 10
- 
+def process_bid(self, user_id, auction_id, amount, bid_id=None, bidder=None):
+    """Processes a single bid and reports its outcome to the bidder."""
+    bid_id = bid_id or str(uuid.uuid4())
     try:
-        with cache.lock(lock_key, timeout=lock_timeout): # type:ignore
-            try:
-                auction = Auction.objects.select_related('item_for_sale').get(
-                    id=auction_id,
-                    item_for_sale__auction_start_date__lte=timezone.now(),
-                    item_for_sale__auction_end_date__gte=timezone.now(),
-                    )
-            except Auction.DoesNotExist:
-                logger.warning(f"Auction {auction_id} does not exist or is not active.")
-                return "Auction does not exist or is not active."
-            
-            if amount <= auction.current_price:
-                logger.warning(f"Bid amount {amount} is not higher than current price {auction.current_price}.")
-                return "Bid amount must be higher than current price."
-            
-            with transaction.atomic():
-                auction.current_price = amount
-                auction.save(update_fields=['current_price'])
-                auction.item_for_sale.active_price = amount
-                auction.item_for_sale.save(update_fields=['active_price'])
-
-                bid = Bid.objects.create(
-                    auction = auction,
-                    creator_id = user_id,
-                    amount = amount
-                )
-                logger.info(f"Bid {bid.id} placed on auction {auction.id} by user {user_id} for amount {amount}.")
-
-                channel_layer = get_channel_layer()
-                group_name = f"auction_{auction_id}"
-                user = User.objects.get(id=user_id)
-
-                async_to_sync(channel_layer.group_send)( #type:ignore
-                    group_name,
-                    {
-                        "type": "auction.update",
-                        "message": {
-                            "new_price": f"{amount:.2f}",
-                            "currency": auction.item_for_sale.price_currency,
-                            "bidder": user.username,
-                            "timestamp": bid.created_at.isoformat(),
-                        }
-                    }
-                )
-                logger.info(f"Successfuly processed bid of {amount} for auction {auction_id}")
+        if settings.BID_ACCEPTANCE_MODE == 'redis':
+            result = _process_bid_in_redis(user_id, auction_id, amount, bid_id, bidder)
+        elif settings.BID_ACCEPTANCE_MODE == 'optimistic':
+            result = _process_bid_optimistically(user_id, auction_id, amount, bid_id, bidder)
+        else:
+            result = _process_bid_with_lock(user_id, auction_id, amount, bid_id, bidder)
     except IntegrityError as e:
         logger.error(f"Database error processing bid for auction {auction_id}: {e}")
+        result = BID_FAILED
     except Exception as e:
         logger.error(f"Error processing bid for auction {auction_id}: {e}")
         try:
             self.retry(exc=e)
         except self.MaxRetriesExceededError:
             logger.error(f"Max retries exceeded for bid on auction {auction_id}")
-            return "Failed to process bid after multiple attempts."
-    return "Bid processed successfully."
+            result = BID_FAILED
+
+    results.publish_bid_results([
+        results.build_bid_result(
+            bid_id, user_id, auction_id, amount, _bid_status(result), detail=result)
+    ])
+    return result
+
+
+def _broadcast_update(auction_id, message, bid_count=1):
+    """Hands a price update to the broadcaster once the current transaction commits."""
+    # a lambda rather than a partial, Django names the callback when it logs a failure
+    transaction.on_commit(
+        lambda: broadcaster.publish_update(auction_id, message, bid_count=bid_count), robust=True)
+
+
+def _bid_status(result):
+    if result == BID_ACCEPTED:
+        return results.ACCEPTED
+    if result == BID_FAILED:
+        return results.FAILED
+    return results.REJECTED
+
+
+def _process_bid_with_lock(user_id, auction_id, amount, bid_id=None, bidder=None):
+    """Compares and commits a bid in Postgres while holding the auction lock."""
+    # resolved up front so the locked section only runs the bid's own queries
+    bidder = bidder or identity.get_username(user_id)
+    lock_key = f"auction_lock:{auction_id}"
+    lock_timeout = 10
+
+    waiting_since = time.perf_counter()
+    with cache.lock(lock_key, timeout=lock_timeout): # type:ignore
+        metrics.record('lock_wait', time.perf_counter() - waiting_since)
+        try:
+            auction = Auction.objects.select_related('item_for_sale').get(
+                id=auction_id,
+                ongoing=True,
+                item_for_sale__auction_start_date__lte=timezone.now(),
+                item_for_sale__auction_end_date__gte=timezone.now(),
+                )
+        except Auction.DoesNotExist:
+            logger.warning(f"Auction {auction_id} does not exist or is not active.")
+            return AUCTION_INACTIVE
+
+        if amount <= auction.current_price:
+            logger.warning(f"Bid amount {amount} is not higher than current price {auction.current_price}.")
+            return BID_TOO_LOW
+
+        with transaction.atomic():
+            # the closer may have closed it since it was read, it does not take the lock
+            if not Auction.objects.filter(id=auction.id, ongoing=True).update(current_price=amount):
+                logger.warning(f"Auction {auction_id} closed before the bid of {amount} was placed.")
+                return AUCTION_INACTIVE
+            auction.current_price = amount
+            auction.item_for_sale.active_price = amount
+            auction.item_for_sale.save(update_fields=['active_price'])
+
+            bid = Bid.objects.create(
+                id = bid_id or uuid.uuid4(),
+                auction = auction,
+                creator_id = user_id,
+                amount = amount
+            )
+            logger.info(f"Bid {bid.id} placed on auction {auction.id} by user {user_id} for amount {amount}.")
+            transaction.on_commit(lambda: live.raise_live_price(
+                auction_id, amount, recent_bids=[live.bid_entry(amount, bidder, bid.created_at)]
+            ), robust=True)
+
+    # sent after the lock is released, nothing waits on the channel layer
+    _broadcast_update(auction_id, {
+        "new_price": f"{amount:.2f}",
+        "currency": auction.item_for_sale.price_currency,
+        "bidder": bidder,
+        "timestamp": bid.created_at.isoformat(),
+    })
+    logger.info(f"Successfuly processed bid of {amount} for auction {auction_id}")
+    return BID_ACCEPTED
+
+
+def _process_bid_in_redis(user_id, auction_id, amount, bid_id=None, bidder=None):
+    """
+    Compares and raises the price with one atomic script against the live
+    record in Redis, the accepted bid is written to Postgres by `persist_bid`.
+    """
+    bidder = bidder or identity.get_username(user_id)
+    status, price, currency = live.accept_bid(auction_id, amount, bidder=bidder, bid_id=bid_id, user_id=user_id)
+    if status == live.MISSING:
+        if not live.load_live_auction(auction_id):
+            logger.warning(f"Auction {auction_id} does not exist or is not active.")
+            return AUCTION_INACTIVE
+        status, price, currency = live.accept_bid(
+            auction_id, amount, bidder=bidder, bid_id=bid_id, user_id=user_id)
+
+    if status == live.INACTIVE:
+        logger.warning(f"Auction {auction_id} does not exist or is not active.")
+        return AUCTION_INACTIVE
+    if status == live.TOO_LOW:
+        logger.warning(f"Bid amount {amount} is not higher than current price {price}.")
+        return BID_TOO_LOW
+
+    persist_bid.delay(user_id=user_id, auction_id=auction_id, amount=amount, bid_id=bid_id)  # type:ignore
+
+    _broadcast_update(auction_id, {
+        "new_price": price,
+        "currency": currency,
+        "bidder": bidder,
+        "timestamp": timezone.now().isoformat(),
+    })
+    logger.info(f"Accepted bid of {amount} for auction {auction_id} in redis")
+    return BID_ACCEPTED
+
+
+def _process_bid_optimistically(user_id, auction_id, amount, bid_id=None, bidder=None):
+    """Commits a bid with one conditional UPDATE and INSERT, without taking the auction lock."""
+    now = timezone.now()
+    bid_id = bid_id or uuid.uuid4()
+    sql = COMMIT_BID_SQL.format(
+        auction_table=Auction._meta.db_table,
+        item_table=AuctionItem._meta.db_table,
+        bid_table=Bid._meta.db_table,
+    )
+    params = {
+        "amount": Decimal(live.format_price(amount)),
+        "now": now,
+        "auction_id": auction_id,
+        "user_id": user_id,
+        "bid_id": bid_id,
+    }
+    for attempt in range(1, OPTIMISTIC_BID_ATTEMPTS + 1):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+            break
+        except OperationalError as e:
+            # deadlocks and serialization failures are safe to replay as-is
+            if attempt == OPTIMISTIC_BID_ATTEMPTS:
+                raise
+            logger.warning(f"Conflict committing bid on auction {auction_id} (attempt {attempt}): {e}")
+            time.sleep(0.01 * attempt)
+
+    if row is None:
+        current_price = Auction.objects.filter(
+            id=auction_id,
+            ongoing=True,
+            item_for_sale__auction_start_date__lte=now,
+            item_for_sale__auction_end_date__gte=now,
+        ).values_list('current_price', flat=True).first()
+        if current_price is None:
+            logger.warning(f"Auction {auction_id} does not exist or is not active.")
+            return AUCTION_INACTIVE
+        logger.warning(f"Bid amount {amount} is not higher than current price {current_price}.")
+        return BID_TOO_LOW
+
+    logger.info(f"Bid {bid_id} placed on auction {auction_id} by user {user_id} for amount {amount}.")
+    bidder = bidder or identity.get_username(user_id)
+    live.raise_live_price(auction_id, amount, recent_bids=[live.bid_entry(amount, bidder, now)])
+
+    _broadcast_update(auction_id, {
+        "new_price": f"{amount:.2f}",
+        "currency": row[0],
+        "bidder": bidder,
+        "timestamp": now.isoformat(),
+    })
+    logger.info(f"Successfuly processed bid of {amount} for auction {auction_id}")
+    return BID_ACCEPTED
+
+
+@shared_task(name='persist_bid', bind=True, max_retries=5, default_retry_delay=1)
+def persist_bid(self, user_id, auction_id, amount, bid_id=None):
+    """
+    Write-behind for bids accepted in Redis. Prices only ever move up, so
+    persisting out of order still leaves Postgres at the highest accepted bid.
+    The closer may have recorded the bid already when it settled the auction
+    on its top bid, and a closed auction's price is left as it was settled.
+    A bid that still cannot be written after the last retry is parked on
+    ``unpersisted_bids`` instead of being dropped.
+    """
+    bid_id = bid_id or str(uuid.uuid4())
+    try:
+        with transaction.atomic():
+            # recorded before the auction row is locked, in the closer's order
+            Bid.objects.bulk_create([
+                Bid(id=bid_id, auction_id=auction_id, creator_id=user_id, amount=amount)
+            ], ignore_conflicts=True)
+            Auction.objects.filter(
+                id=auction_id, ongoing=True, current_price__lt=amount
+            ).update(current_price=amount, updated_at=timezone.now())
+            AuctionItem.objects.filter(
+                auction__id=auction_id, auction__ongoing=True, active_price__lt=amount
+            ).update(active_price=amount, updated_at=timezone.now())
+        logger.info(f"Persisted bid {bid_id} on auction {auction_id} by user {user_id} for amount {amount}.")
+    except Exception as e:
+        logger.error(f"Error persisting bid for auction {auction_id}: {e}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        _park_unpersisted_bid(user_id, auction_id, amount, bid_id)
+        return "Bid parked for replay."
+    return "Bid persisted successfully."
+
+
+def _park_unpersisted_bid(user_id, auction_id, amount, bid_id):
+    bid = json.dumps({
+        "bid_id": bid_id, "user_id": user_id, "auction_id": auction_id, "amount": live.format_price(amount)})
+    # logged in full so the bid survives even if Redis is what failed
+    logger.critical(f"Accepted bid could not be persisted, parked on {UNPERSISTED_BIDS_KEY}: {bid}")
+    try:
+        live.get_redis_client().rpush(UNPERSISTED_BIDS_KEY, bid)
+    except Exception as e:
+        logger.critical(f"Error parking unpersisted bid {bid_id}: {e}")
+
+
+@shared_task(name='match_pending_bids', bind=True, max_retries=3, default_retry_delay=1)
+def match_pending_bids(self, auction_id):
+    """
+    Drains every pending bid for an auction and matches them in arrival order,
+    accepting each bid that beats the running price exactly as serial
+    processing would, then commits all of them with one write per table.
+    """
+    redis_client = live.get_redis_client()
+    queue_key = PENDING_BIDS_KEY.format(auction_id=auction_id)
+    lock_key = f"auction_lock:{auction_id}"
+
+    waiting_since = time.perf_counter()
+    with cache.lock(lock_key, timeout=10):  # type:ignore
+        metrics.record('lock_wait', time.perf_counter() - waiting_since)
+        # clear the flag first, bids pushed from here on schedule another run
+        redis_client.delete(MATCHER_SCHEDULED_KEY.format(auction_id=auction_id))
+        pipe = redis_client.pipeline()
+        pipe.lrange(queue_key, 0, -1)
+        pipe.delete(queue_key)
+        raw_bids, _ = pipe.execute()
+        if not raw_bids:
+            return "No pending bids."
+
+        pending_bids = [json.loads(raw) for raw in raw_bids]
+        try:
+            return _match_bids(auction_id, pending_bids)
+        except Exception as e:
+            logger.error(f"Error matching bids for auction {auction_id}: {e}")
+            if self.request.retries >= self.max_retries:
+                # nothing would run for them again, so their bidders hear it now
+                logger.error(f"Max retries exceeded, failed {len(pending_bids)} bids on auction {auction_id}")
+                results.publish_bid_results([
+                    results.build_bid_result(
+                        pending['bid_id'], pending['user_id'], auction_id, Decimal(pending['amount']),
+                        results.FAILED, detail=BID_FAILED)
+                    for pending in pending_bids
+                ])
+                return BID_FAILED
+            # put the drained bids back in front so the retry sees them in order
+            redis_client.lpush(queue_key, *reversed(raw_bids))
+            raise self.retry(exc=e)
+
+
+def _match_bids(auction_id, pending_bids):
+    now = timezone.now()
+    auction = Auction.objects.select_related('item_for_sale').filter(
+        id=auction_id,
+        ongoing=True,
+        item_for_sale__auction_start_date__lte=now,
+        item_for_sale__auction_end_date__gte=now,
+    ).first()
+    if auction is None:
+        return _reject_inactive(auction_id, pending_bids)
+
+    price = auction.current_price
+    accepted = []
+    bidders = {}
+    outcomes = []
+    for pending in pending_bids:
+        amount = Decimal(pending['amount'])
+        if amount > price:
+            price = amount
+            accepted.append(Bid(
+                id=pending['bid_id'], auction=auction, creator_id=pending['user_id'], amount=amount))
+            if pending.get('bidder'):
+                bidders[str(pending['user_id'])] = pending['bidder']
+            status, detail = results.ACCEPTED, BID_ACCEPTED
+        else:
+            status, detail = results.REJECTED, BID_TOO_LOW
+        outcomes.append(results.build_bid_result(
+            pending['bid_id'], pending['user_id'], auction_id, amount, status, detail=detail))
+    if not accepted:
+        logger.info(f"None of {len(pending_bids)} pending bids beat {auction.current_price} on auction {auction_id}")
+        results.publish_bid_results(outcomes)
+        return "Matched 0 bids."
+
+    unnamed = [bid.creator_id for bid in accepted if str(bid.creator_id) not in bidders]  # type:ignore
+    bidders.update(identity.get_usernames(unnamed))
+    with transaction.atomic():
+        # the closer may have closed it since it was read, it does not take the lock
+        if not Auction.objects.filter(id=auction.id, ongoing=True).update(current_price=price, updated_at=now):
+            return _reject_inactive(auction_id, pending_bids)
+        Bid.objects.bulk_create(accepted)
+        AuctionItem.objects.filter(id=auction.item_for_sale_id).update(  # type:ignore
+            active_price=price, updated_at=now)
+        recent_bids = [
+            live.bid_entry(bid.amount, bidders.get(str(bid.creator_id)), bid.created_at)  # type:ignore
+            for bid in accepted
+        ]
+        transaction.on_commit(
+            lambda: live.raise_live_price(auction_id, price, recent_bids=recent_bids), robust=True)
+
+    winning_bid = accepted[-1]
+    _broadcast_update(auction_id, {
+        "new_price": f"{price:.2f}",
+        "currency": auction.item_for_sale.price_currency,
+        "bidder": bidders.get(str(winning_bid.creator_id)),  # type:ignore
+        "timestamp": winning_bid.created_at.isoformat(),
+    }, bid_count=len(accepted))
+    # the bids are committed, failing here would send them back to the queue
+    # and the retry would fail the accepted ones on their existing rows
+    try:
+        results.publish_bid_results(outcomes)
+    except Exception as e:
+        logger.error(f"Error reporting {len(outcomes)} matched bids on auction {auction_id}: {e}")
+    logger.info(f"Matched {len(accepted)} of {len(pending_bids)} bids on auction {auction_id}, price is now {price}")
+    return f"Matched {len(accepted)} bids."
+
+
+def _reject_inactive(auction_id, pending_bids):
+    logger.warning(f"Auction {auction_id} does not exist or is not active, dropped {len(pending_bids)} bids.")
+    results.publish_bid_results([
+        results.build_bid_result(
+            pending['bid_id'], pending['user_id'], auction_id, Decimal(pending['amount']),
+            results.REJECTED, detail=AUCTION_INACTIVE)
+        for pending in pending_bids
+    ])
+    return AUCTION_INACTIVE
 
 
 @shared_task(name='close_finished_auctions')
 def close_finished_auctions():
+    """
+    Closes every auction whose end time has come, as popped from the end time
+    set, a batch per transaction: the due auctions are locked, then winners
+    are picked and auctions closed in one query, and the batch is announced
+    once it has committed.
+    """
+    redis_client = live.get_redis_client()
     now = timezone.now()
-    auctions_to_close = Auction.objects.filter(
-        ongoing=True,
-        item_for_sale__auction_end_date__lt = now
-    )
     closed_count = 0
-    for auction in auctions_to_close:
-        winning_bid = auction.active_bids.order_by('-amount', 'created_at').first() #type:ignore
-
-        auction.ongoing = False
-        if winning_bid:
-            auction.winner = winning_bid.creator
-
-        auction.save(update_fields=['ongoing', 'winner'])
-        closed_count += 1
-        logger.info(f"Closed auction {auction.id}. Winner: {auction.winner}")
-        
-        channel_layer = get_channel_layer()
-        group_name = f"auction_{auction.id}"
-        async_to_sync(channel_layer.group_send)( # type: ignore
-            group_name,
-            {
-                "type": "auction.closed", 
-                "message": {
-                    "final_price": f"{auction.current_price:.2f}",
-                    "winner": auction.winner.username if auction.winner else "No winner",
-                }
+    while auction_ids := live.claim_due(scheduler.AUCTION_ENDINGS_KEY, now, CLOSE_BATCH_SIZE, client=redis_client):
+        try:
+            closed_count += _close_auctions(auction_ids, now)
+        except Exception as e:
+            logger.error(f"Error closing {len(auction_ids)} auctions: {e}")
+            # claimed again on the next run
+            redis_client.zadd(scheduler.AUCTION_ENDINGS_KEY, {auction_id: now.timestamp() for auction_id in auction_ids})
+            break
+        if len(auction_ids) < CLOSE_BATCH_SIZE:
+            break
+    if closed_count:
+        logger.info(f"Closed {closed_count} auctions")
+    return f"Closed {closed_count} auctions."
+
+
+def _close_auctions(auction_ids, now):
+    tables = {
+        "auction_table": Auction._meta.db_table,
+        "item_table": AuctionItem._meta.db_table,
+        "bid_table": Bid._meta.db_table,
+    }
+    # bids accepted in Redis count even when their write-behind is still queued
+    top_bids = live.get_top_bids(auction_ids)
+    with transaction.atomic():
+        if top_bids:
+            _settle_top_bids(top_bids, now)
+        with connection.cursor() as cursor:
+            cursor.execute(LOCK_EXPIRED_AUCTIONS_SQL.format(**tables), {
+                "now": now, "auction_ids": [uuid.UUID(auction_id) for auction_id in auction_ids]})
+            expired = [uuid.UUID(str(auction_id)) for auction_id, in cursor.fetchall()]
+            closed = []
+            if expired:
+                cursor.execute(CLOSE_AUCTIONS_SQL.format(**tables), {"now": now, "auction_ids": expired})
+                closed = cursor.fetchall()
+        usernames = identity.get_usernames(
+            [winner_id for _, _, winner_id in closed if winner_id is not None])
+        final_states = {
+            str(auction_id): {
+                "final_price": f"{current_price:.2f}",
+                "winner": usernames.get(str(winner_id)) or "No winner",
             }
-        )
+            for auction_id, current_price, winner_id in closed
+        }
+        transaction.on_commit(lambda: _announce_closed(final_states), robust=True)
+    # claimed but not due after all, their end was moved since it was scheduled
+    left_open = set(auction_ids) - final_states.keys()
+    if left_open:
+        scheduler.requeue_open_auctions(left_open)
+    return len(closed)
+
+
+def _settle_top_bids(top_bids, now):
+    """Records the top bids accepted in Redis that are not in Postgres yet and raises their auctions to them."""
+    Bid.objects.bulk_create([
+        Bid(id=top_bid['bid_id'], auction_id=auction_id, creator_id=top_bid['user_id'], amount=top_bid['amount'])
+        for auction_id, top_bid in top_bids.items()
+    ], ignore_conflicts=True)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            RAISE_TO_TOP_BIDS_SQL.format(
+                auction_table=Auction._meta.db_table, item_table=AuctionItem._meta.db_table),
+            {
+                "now": now,
+                "auction_ids": [uuid.UUID(auction_id) for auction_id in top_bids],
+                "amounts": [Decimal(top_bid['amount']) for top_bid in top_bids.values()],
+            })
+
 
-    return f"Closed {closed_count} auctions."
\ No newline at end of file
+def _announce_closed(final_states):
+    """Tells sockets still connecting and everyone watching that the auctions are over."""
+    live.close_live_auctions({
+        auction_id: {**final_state, "auction_id": auction_id}
+        for auction_id, final_state in final_states.items()
+    })
+    broadcaster.send_events('auction.closed', 'auction_closed', final_states)
@@ -1,12 +1,37 @@
+import asyncio
+import json
+import uuid
 from datetime import timedelta
+from functools import partial
 from unittest.mock import patch, MagicMock
-from django.test import TestCase, override_settings
+import msgpack
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from asgiref.sync import async_to_sync, sync_to_async
+from rest_framework.test import APITestCase, APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
 from auction.models import AuctionItem, Auction, Bid
-from auction.tasks import create_pending_auctions_from_cache, process_bid, close_finished_auctions
+from auction.consumers import LAGGING_CLOSE_CODE
+from auction.outbox import (
+    LatestValueOutbox, get_connection_stats, LAGGING_DISCONNECTS, WEBSOCKET_STATS_KEY
+)
+from auction.routing import watch_urlpatterns, websocket_urlpatterns
+from auction import broadcaster, compact, identity, live, phases, results, scheduler
+from auction.tasks import (
+    process_bid, close_finished_auctions, persist_bid,
+    enqueue_bid, match_pending_bids, refresh_live_auction_ids, _close_auctions,
+    AUCTION_INACTIVE, BID_FAILED, PENDING_BIDS_KEY, MATCHER_SCHEDULED_KEY, UNPERSISTED_BIDS_KEY
+)
 
 User = get_user_model()
 
@@ -90,42 +115,197 @@ class AuctionModelTests(TestCase):
             str(bid), f"Bid placed on Auction {auction.id} by {self.user} (250.00)")
 
 
-@override_settings(CHANNEL_LAYERS={
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    }
-})
-class CeleryTaskTests(TestCase):
+def auth_client(user):
+    refresh = RefreshToken.for_user(user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+    return client
+
+
+class AuctionItemFlowTests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
-            username="seller", email="seller@example.com", password="pass123"
+            username="seller", email="seller@example.com", password="pass1234"
         )
+        self.client = auth_client(self.user)
 
-    @patch('auction.tasks.cache.client.get_client')
-    def test_create_pending_auctions_task(self, mock_redis):
-        mock_redis_client = MagicMock()
-        mock_redis.return_value = mock_redis_client
+    def test_create_and_list_auction_items(self):
+        start = timezone.now() + timedelta(hours=1)
+        end = start + timedelta(hours=2)
+        payload = {
+            "item_name": "Vintage Watch",
+            "details": "Rare collectors edition",
+            "auction_start_date": start.isoformat(),
+            "auction_end_date": end.isoformat(),
+            "initial_price": "100.00",
+            "price_currency": "Dollars",
+        }
+        url = reverse("create_auction_item")
+        res = self.client.post(url, payload, format="json")
+        body = res.json()
+        self.assertEqual(res.status_code, 201, body)
+        item_id = body.get("data", {}).get("id")
 
-        start = timezone.now() + timedelta(minutes=3)
-        end = start + timedelta(hours=1)
+        list_url = reverse("list_auction_item")
+        list_res = self.client.get(list_url)
+        list_body = list_res.json()
+        self.assertEqual(list_res.status_code, 200)
+        self.assertTrue(len(list_body.get("data")) >= 1)
 
+        detail_url = reverse("auction_item_detail",
+                             kwargs={"item_id": item_id})
+        detail_res = self.client.get(detail_url)
+        detail_body = detail_res.json()
+        self.assertEqual(detail_res.status_code, 200)
+        self.assertEqual(detail_body["data"]["item_name"], "Vintage Watch")
+
+    def test_update_and_delete_auction_item(self):
+        start = timezone.now() + timedelta(hours=1)
+        end = start + timedelta(hours=2)
         item = AuctionItem.objects.create(
             creator=self.user,
-            item_name="Watch",
-            details="Vintage watch",
+            item_name="Old Camera",
+            details="Working condition",
             auction_start_date=start,
             auction_end_date=end,
-            initial_price="150.00",
-            active_price="150.00",
-            price_currency="Dollars"
+            initial_price="50.00",
+            active_price="50.00",
+            price_currency="Dollars",
+        )
+
+        update_url = reverse("update_delete_auction_item",
+                             kwargs={"item_id": str(item.id)})
+        res = self.client.put(
+            update_url, {"item_name": "Updated Camera"}, format="json")
+        res_body = res.json()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res_body["data"]["item_name"], "Updated Camera")
+
+        # not ongoing -> can delete
+        del_res = self.client.delete(update_url)
+        self.assertIn(del_res.status_code, (200, 204))
+
+
+class AuctionBiddingTests(APITestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(
+            username="seller", email="seller@example.com", password="pass1234"
+        )
+        self.bidder = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass1234"
+        )
+        start = timezone.now() - timedelta(minutes=5)
+        end = timezone.now() + timedelta(minutes=30)
+        self.item = AuctionItem.objects.create(
+            creator=self.seller,
+            item_name="Laptop",
+            details="Gaming",
+            auction_start_date=start,
+            auction_end_date=end,
+            initial_price="200.00",
+            active_price="200.00",
+            price_currency="Dollars",
+        )
+        self.auction = Auction.objects.create(
+            item_for_sale=self.item,
+            current_price=self.item.initial_price,
+            ongoing=True,
+        )
+        self.client = auth_client(self.bidder)
+
+    def tearDown(self):
+        client = live.get_redis_client()
+        # loaded by the bid views, which also make the auction watchable
+        client.srem(live.LIVE_AUCTION_IDS_KEY, str(self.auction.id))
+        client.delete(live.live_auction_key(self.auction.id), live.recent_bids_key(self.auction.id))
+
+    def test_place_bid_enqueues_task(self):
+        url = reverse("place_bid", kwargs={"auction_id": str(self.auction.id)})
+        # Patch Celery delay to avoid needing a broker in tests
+        with patch("auction.tasks.enqueue_bid") as mocked_task:
+            mocked_task.return_value = None
+            res = self.client.post(url, {"amount": 250}, format="json")
+            self.assertEqual(res.status_code, 202)
+
+    def test_place_bid_returns_id_for_result_lookup(self):
+        url = reverse("place_bid", kwargs={"auction_id": str(self.auction.id)})
+        with patch("auction.tasks.process_bid") as mocked_task:
+            res = self.client.post(url, {"amount": 250}, format="json")
+            self.assertEqual(res.status_code, 202)
+        bid_id = res.json()["data"]["bid_id"]
+        mocked_task.delay.assert_called_once_with(
+            user_id=str(self.bidder.id), auction_id=str(self.auction.id), amount=250.0, bid_id=bid_id,
+            bidder="bidder")
+
+        result_url = reverse("bid_result", kwargs={"bid_id": bid_id})
+        res = self.client.get(result_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["data"]["status"], "pending")
+
+        # results are private to the bidder
+        res = auth_client(self.seller).get(result_url)
+        self.assertEqual(res.status_code, 404)
+        live.get_redis_client().delete(results.bid_result_key(bid_id))
+
+    def test_place_bid_rejects_losing_bid_without_queueing(self):
+        url = reverse("place_bid", kwargs={"auction_id": str(self.auction.id)})
+        with patch("auction.tasks.enqueue_bid") as mocked_task:
+            res = self.client.post(url, {"amount": 150}, format="json")
+            self.assertEqual(res.status_code, 409)
+            mocked_task.assert_not_called()
+
+    def test_place_bid_rejects_bid_after_auction_end(self):
+        self.item.auction_end_date = timezone.now() - timedelta(minutes=1)
+        self.item.save()
+        url = reverse("place_bid", kwargs={"auction_id": str(self.auction.id)})
+        with patch("auction.tasks.enqueue_bid") as mocked_task:
+            res = self.client.post(url, {"amount": 250}, format="json")
+            self.assertEqual(res.status_code, 409)
+            mocked_task.assert_not_called()
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="seller", email="seller@example.com", password="pass1234"
+        )
+        self.client = APIClient()
+        start = timezone.now() + timedelta(hours=1)
+        end = start + timedelta(hours=2)
+        AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Apple iPhone",
+            details="Smartphone",
+            auction_start_date=start,
+            auction_end_date=end,
+            initial_price="300.00",
+            active_price="300.00",
+            price_currency="Dollars",
         )
 
-        mock_redis_client.zrangebyscore.return_value = [str(item.id).encode()]
+    def test_master_search_requires_query(self):
+        url = reverse("master_search")
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, 400)
+
+    def test_master_search_returns_results(self):
+        url = reverse("master_search")
+        res = self.client.get(url, {"q": "iphone"})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("data", res.json())
 
-        result = create_pending_auctions_from_cache()
 
-        self.assertIn("Total pending auctions created: 1", result)
-        self.assertTrue(Auction.objects.filter(item_for_sale=item).exists())
+
+@override_settings(CHANNEL_LAYERS={
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    }
+})
+class CeleryTaskTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="seller", email="seller@example.com", password="pass123"
+        )
 
     @patch('auction.tasks.cache.lock')
     def test_process_bid_task(self, mock_cache_lock):
@@ -161,6 +341,61 @@ class CeleryTaskTests(TestCase):
         self.assertTrue(Bid.objects.filter(
             auction=auction, amount=350.0).exists())
 
+    @patch('auction.tasks.cache.lock')
+    def test_process_bid_rejects_bid_on_closed_auction(self, mock_cache_lock):
+        mock_cache_lock.return_value.__enter__ = MagicMock()
+        mock_cache_lock.return_value.__exit__ = MagicMock(return_value=False)
+
+        item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Tablet",
+            details="Android tablet",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(seconds=1),
+            initial_price="300.00",
+            price_currency="Dollars"
+        )
+        # closed by the closer at its end second, before the end date passed here
+        auction = Auction.objects.create(
+            item_for_sale=item, current_price=item.initial_price, ongoing=False)
+
+        result = process_bid(str(self.user.id), str(auction.id), 350.0)  # type:ignore
+
+        self.assertEqual(result, AUCTION_INACTIVE)
+        auction.refresh_from_db()
+        self.assertEqual(float(auction.current_price), 300.0)
+        self.assertFalse(Bid.objects.filter(auction=auction).exists())
+
+    @patch('auction.tasks.cache.lock')
+    def test_process_bid_reports_result(self, mock_cache_lock):
+        mock_cache_lock.return_value.__enter__ = MagicMock()
+        mock_cache_lock.return_value.__exit__ = MagicMock(return_value=False)
+
+        item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Bike",
+            details="Road bike",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="300.00",
+            price_currency="Dollars"
+        )
+        auction = Auction.objects.create(
+            item_for_sale=item,
+            current_price=item.initial_price,
+            ongoing=True
+        )
+        accepted_id, rejected_id = str(uuid.uuid4()), str(uuid.uuid4())
+
+        process_bid(str(self.user.id), str(auction.id), 350.0, bid_id=accepted_id)  # type:ignore
+        process_bid(str(self.user.id), str(auction.id), 320.0, bid_id=rejected_id)  # type:ignore
+
+        self.assertEqual(results.get_bid_result(accepted_id)['status'], results.ACCEPTED)  # type:ignore
+        self.assertEqual(results.get_bid_result(rejected_id)['status'], results.REJECTED)  # type:ignore
+        self.assertTrue(Bid.objects.filter(id=accepted_id).exists())
+        cache.client.get_client().delete(  # type:ignore
+            results.bid_result_key(accepted_id), results.bid_result_key(rejected_id))
+
     def test_close_finished_auctions_task(self):
         past_time = timezone.now() - timedelta(hours=1)
 
@@ -187,9 +422,1144 @@ class CeleryTaskTests(TestCase):
             amount="75.00"
         )
 
-        result = close_finished_auctions()
+        live.add_live_auction_ids([auction.id])
+        live.get_redis_client().zadd(scheduler.AUCTION_ENDINGS_KEY, {str(auction.id): past_time.timestamp()})
+        with self.captureOnCommitCallbacks(execute=True):
+            result = close_finished_auctions()
 
         auction.refresh_from_db()
         self.assertFalse(auction.ongoing)
         self.assertEqual(auction.winner, self.user)
         self.assertIn("Closed 1 auctions", result)
+        is_live, final_state = live.get_watch_states([auction.id])[str(auction.id)]
+        self.assertFalse(is_live)
+        self.assertEqual(final_state, {
+            "final_price": "75.00", "winner": "seller", "auction_id": str(auction.id)})
+        live.get_redis_client().delete(live.FINAL_STATE_KEY.format(auction_id=auction.id))
+
+    @patch('auction.tasks.broadcaster.send_events')
+    def test_finished_auctions_are_closed_in_bulk(self, mock_send_events):
+        past_time = timezone.now() - timedelta(hours=1)
+        rival = User.objects.create_user(username="rival", email="rival@example.com", password="pass123")
+        auctions = []
+        for _ in range(4):
+            item = AuctionItem.objects.create(
+                creator=self.user, item_name="Book", details="Rare book",
+                auction_start_date=past_time - timedelta(hours=2), auction_end_date=past_time,
+                initial_price="50.00",
+            )
+            auctions.append(Auction.objects.create(item_for_sale=item, current_price="90.00"))
+        live.get_redis_client().zadd(scheduler.AUCTION_ENDINGS_KEY, {
+            str(auction.id): past_time.timestamp() for auction in auctions})
+        for auction in auctions[:3]:
+            Bid.objects.create(creator=self.user, auction=auction, amount="80.00")
+            # the earliest of the highest bids wins
+            Bid.objects.create(creator=rival, auction=auction, amount="90.00")
+            Bid.objects.create(creator=self.user, auction=auction, amount="90.00")
+
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            result = close_finished_auctions()
+        self.assertIn("Closed 4 auctions", result)
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(
+            Auction.objects.filter(ongoing=False, winner=rival).count(), 3)
+        self.assertEqual(Auction.objects.get(id=auctions[3].id).winner, None)
+        final_states = mock_send_events.call_args.args[2]
+        self.assertEqual(final_states[str(auctions[0].id)], {"final_price": "90.00", "winner": "rival"})
+        self.assertEqual(final_states[str(auctions[3].id)], {"final_price": "90.00", "winner": "No winner"})
+        live.get_redis_client().delete(*[
+            live.FINAL_STATE_KEY.format(auction_id=auction.id) for auction in auctions])
+
+    def test_auction_endings_are_reconciled_with_postgres(self):
+        end = timezone.now() + timedelta(minutes=30)
+        item = AuctionItem.objects.create(
+            creator=self.user, item_name="Radio", details="Tube radio",
+            auction_start_date=timezone.now() - timedelta(minutes=5), auction_end_date=end,
+            initial_price="20.00",
+        )
+        auction = Auction.objects.create(item_for_sale=item, current_price=item.initial_price, ongoing=True)
+        client = live.get_redis_client()
+        stale_id = str(uuid.uuid4())
+        client.zadd(scheduler.AUCTION_ENDINGS_KEY, {stale_id: 0})
+        try:
+            self.assertEqual(scheduler.reconcile_auction_endings(), (1, 1))
+            self.assertEqual(client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)), end.timestamp())
+            self.assertIsNone(client.zscore(scheduler.AUCTION_ENDINGS_KEY, stale_id))
+            self.assertEqual(scheduler.reconcile_auction_endings(), (0, 0))
+            # not due yet, so the closer leaves it open
+            self.assertIn("Closed 0 auctions", close_finished_auctions())
+        finally:
+            client.zrem(scheduler.AUCTION_ENDINGS_KEY, str(auction.id), stale_id)
+
+    def test_refresh_live_auction_ids_reconciles_with_postgres(self):
+        item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Radio",
+            details="Tube radio",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="20.00",
+        )
+        auction = Auction.objects.create(item_for_sale=item, current_price=item.initial_price, ongoing=True)
+        client = live.get_redis_client()
+        stale_id = str(uuid.uuid4())
+        client.sadd(live.LIVE_AUCTION_IDS_KEY, stale_id)
+        try:
+            refresh_live_auction_ids()
+            self.assertTrue(client.sismember(live.LIVE_AUCTION_IDS_KEY, str(auction.id)))
+            self.assertFalse(client.sismember(live.LIVE_AUCTION_IDS_KEY, stale_id))
+        finally:
+            client.srem(live.LIVE_AUCTION_IDS_KEY, str(auction.id), stale_id)
+
+
+@override_settings(
+    BID_ACCEPTANCE_MODE='redis',
+    CHANNEL_LAYERS={
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    })
+class RedisBidAcceptanceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass123"
+        )
+        item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Camera",
+            details="Film camera",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="100.00",
+            price_currency="Dollars"
+        )
+        self.auction = Auction.objects.create(
+            item_for_sale=item,
+            current_price=item.initial_price,
+            ongoing=True
+        )
+
+    def tearDown(self):
+        client = cache.client.get_client()  # type:ignore
+        client.srem(live.LIVE_AUCTION_IDS_KEY, str(self.auction.id))
+        client.delete(live.live_auction_key(self.auction.id), live.recent_bids_key(self.auction.id))
+
+    @patch('auction.tasks.persist_bid')
+    def test_process_bid_accepts_in_redis(self, mock_persist):
+        bid_id = str(uuid.uuid4())
+        result = process_bid(str(self.user.id), str(self.auction.id), 150.0, bid_id=bid_id)  # type:ignore
+        self.assertEqual(result, "Bid processed successfully.")
+        mock_persist.delay.assert_called_once_with(
+            user_id=str(self.user.id), auction_id=str(self.auction.id), amount=150.0, bid_id=bid_id)
+
+        result = process_bid(str(self.user.id), str(self.auction.id), 120.0)  # type:ignore
+        self.assertEqual(result, "Bid amount must be higher than current price.")
+        self.assertEqual(mock_persist.delay.call_count, 1)
+
+    @patch('auction.tasks.persist_bid')
+    def test_accepted_bids_fill_the_snapshot(self, mock_persist):
+        for amount in (150.0, 120.0, 180.0):
+            process_bid(str(self.user.id), str(self.auction.id), amount, bidder="bidder")  # type:ignore
+        # a bid committed elsewhere after a higher one is counted without lowering the price
+        live.raise_live_price(self.auction.id, 170.0, recent_bids=[
+            live.bid_entry(170.0, "latecomer", timezone.now())])
+
+        snapshot = live.get_snapshot(self.auction.id)
+        self.assertEqual(snapshot["price"], "180.00")  # type:ignore
+        self.assertEqual(snapshot["currency"], "Dollars")  # type:ignore
+        self.assertEqual(snapshot["bid_count"], 3)  # type:ignore
+        self.assertEqual(
+            [(bid["amount"], bid["bidder"]) for bid in snapshot["recent_bids"]],  # type:ignore
+            [("180.00", "bidder"), ("170.00", "latecomer"), ("150.00", "bidder")])
+        self.assertEqual(
+            snapshot["end_time"], self.auction.item_for_sale.auction_end_date.isoformat())  # type:ignore
+        self.assertIsNone(live.get_snapshot(uuid.uuid4()))
+
+    def test_persist_bid_never_lowers_price(self):
+        persist_bid(str(self.user.id), str(self.auction.id), 180.0)  # type:ignore
+        persist_bid(str(self.user.id), str(self.auction.id), 150.0)  # type:ignore
+
+        self.auction.refresh_from_db()
+        self.auction.item_for_sale.refresh_from_db()
+        self.assertEqual(float(self.auction.current_price), 180.0)
+        self.assertEqual(float(self.auction.item_for_sale.active_price), 180.0)
+        self.assertEqual(self.auction.active_bids.count(), 2)  # type:ignore
+
+    @patch('auction.tasks.persist_bid')
+    def test_auctions_close_on_bids_not_persisted_yet(self, mock_persist):
+        bid_id = str(uuid.uuid4())
+        process_bid(str(self.user.id), str(self.auction.id), 150.0, bid_id=bid_id)  # type:ignore
+        # the auction ends before the write-behind ran
+        AuctionItem.objects.filter(id=self.auction.item_for_sale_id).update(  # type:ignore
+            auction_end_date=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(_close_auctions([str(self.auction.id)], timezone.now()), 1)
+
+        # and landing late it changes nothing
+        persist_bid(str(self.user.id), str(self.auction.id), 150.0, bid_id=bid_id)  # type:ignore
+        persist_bid(str(self.user.id), str(self.auction.id), 160.0)  # type:ignore
+        self.auction.refresh_from_db()
+        self.assertFalse(self.auction.ongoing)
+        self.assertEqual(self.auction.winner, self.user)
+        self.assertEqual(float(self.auction.current_price), 150.0)
+        self.assertEqual(self.auction.active_bids.count(), 2)  # type:ignore
+
+    @patch('auction.tasks.Bid.objects.bulk_create', side_effect=OperationalError("database down"))
+    def test_unpersistable_bids_are_parked(self, mock_bulk_create):
+        client = cache.client.get_client()  # type:ignore
+        try:
+            with patch.object(persist_bid, 'max_retries', 0):
+                result = persist_bid(str(self.user.id), str(self.auction.id), 150.0, bid_id="parked")  # type:ignore
+            self.assertEqual(result, "Bid parked for replay.")
+            self.assertEqual(json.loads(client.lpop(UNPERSISTED_BIDS_KEY)), {
+                "bid_id": "parked", "user_id": str(self.user.id),
+                "auction_id": str(self.auction.id), "amount": "150.00"})
+        finally:
+            client.delete(UNPERSISTED_BIDS_KEY)
+
+
+@override_settings(
+    BID_ACCEPTANCE_MODE='batch',
+    CHANNEL_LAYERS={
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    })
+class BatchBidMatchingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass123"
+        )
+        item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Lamp",
+            details="Desk lamp",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="100.00",
+            price_currency="Dollars"
+        )
+        self.auction = Auction.objects.create(
+            item_for_sale=item,
+            current_price=item.initial_price,
+            ongoing=True
+        )
+
+    def tearDown(self):
+        cache.client.get_client().delete(  # type:ignore
+            PENDING_BIDS_KEY.format(auction_id=self.auction.id),
+            MATCHER_SCHEDULED_KEY.format(auction_id=self.auction.id),
+        )
+
+    @patch('auction.tasks.broadcaster.publish_update')
+    @patch('auction.tasks.match_pending_bids.delay')
+    def test_pending_bids_are_matched_in_one_pass(self, mock_delay, mock_publish):
+        for amount in (150.0, 120.0, 180.0, 170.0):
+            enqueue_bid(str(self.user.id), str(self.auction.id), amount)
+        mock_delay.assert_called_once_with(auction_id=str(self.auction.id))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            result = match_pending_bids(str(self.auction.id))  # type:ignore
+        # the update only goes out once the bids are committed
+        mock_publish.assert_not_called()
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(result, "Matched 2 bids.")
+        self.auction.refresh_from_db()
+        self.assertEqual(float(self.auction.current_price), 180.0)
+        self.assertEqual(
+            sorted(float(b.amount) for b in self.auction.active_bids.all()),  # type:ignore
+            [150.0, 180.0])
+        mock_publish.assert_called_once()
+        self.assertEqual(mock_publish.call_args.args[1]["new_price"], "180.00")
+        self.assertEqual(mock_publish.call_args.kwargs["bid_count"], 2)
+
+    @patch('auction.tasks.match_pending_bids.delay')
+    def test_bids_on_auction_closed_while_matching_are_rejected(self, mock_delay):
+        bid_ids = [enqueue_bid(str(self.user.id), str(self.auction.id), amount) for amount in (150.0, 160.0)]
+
+        def close_auction(user_ids):
+            Auction.objects.filter(id=self.auction.id).update(ongoing=False)
+            return {}
+
+        try:
+            with patch('auction.tasks.identity.get_usernames', side_effect=close_auction):
+                self.assertEqual(match_pending_bids(str(self.auction.id)), AUCTION_INACTIVE)  # type:ignore
+            self.auction.refresh_from_db()
+            self.assertEqual(float(self.auction.current_price), 100.0)
+            self.assertFalse(self.auction.active_bids.exists())  # type:ignore
+            self.assertEqual(
+                [results.get_bid_result(bid_id)['status'] for bid_id in bid_ids],  # type:ignore
+                [results.REJECTED, results.REJECTED])
+        finally:
+            cache.client.get_client().delete(*[results.bid_result_key(bid_id) for bid_id in bid_ids])  # type:ignore
+
+    @patch('auction.tasks.results.publish_bid_results', side_effect=ConnectionError("redis down"))
+    @patch('auction.tasks.match_pending_bids.delay')
+    def test_committed_bids_are_not_matched_again(self, mock_delay, mock_publish):
+        bid_ids = [enqueue_bid(str(self.user.id), str(self.auction.id), amount) for amount in (150.0, 160.0)]
+        try:
+            with patch.object(match_pending_bids, 'retry') as mock_retry:
+                self.assertEqual(match_pending_bids(str(self.auction.id)), "Matched 2 bids.")  # type:ignore
+            mock_retry.assert_not_called()
+            self.assertEqual(self.auction.active_bids.count(), 2)  # type:ignore
+            self.assertEqual(cache.client.get_client().llen(  # type:ignore
+                PENDING_BIDS_KEY.format(auction_id=self.auction.id)), 0)
+        finally:
+            cache.client.get_client().delete(*[results.bid_result_key(bid_id) for bid_id in bid_ids])  # type:ignore
+
+    @patch('auction.tasks._match_bids', side_effect=OperationalError("database down"))
+    @patch('auction.tasks.match_pending_bids.delay')
+    def test_bids_fail_once_matching_gives_up(self, mock_delay, mock_match):
+        bid_ids = [enqueue_bid(str(self.user.id), str(self.auction.id), amount) for amount in (150.0, 160.0)]
+        try:
+            with patch.object(match_pending_bids, 'max_retries', 0):
+                self.assertEqual(match_pending_bids(str(self.auction.id)), BID_FAILED)  # type:ignore
+            self.assertEqual(
+                [results.get_bid_result(bid_id)['status'] for bid_id in bid_ids],  # type:ignore
+                [results.FAILED, results.FAILED])
+            self.assertEqual(cache.client.get_client().llen(  # type:ignore
+                PENDING_BIDS_KEY.format(auction_id=self.auction.id)), 0)
+        finally:
+            cache.client.get_client().delete(*[results.bid_result_key(bid_id) for bid_id in bid_ids])  # type:ignore
+
+
+@override_settings(
+    BID_ACCEPTANCE_MODE='optimistic',
+    CHANNEL_LAYERS={
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    })
+class OptimisticBidTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass123"
+        )
+        self.item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Guitar",
+            details="Acoustic guitar",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="100.00",
+            price_currency="Dollars"
+        )
+        self.auction = Auction.objects.create(
+            item_for_sale=self.item,
+            current_price=self.item.initial_price,
+            ongoing=True
+        )
+
+    @patch('auction.tasks.cache.lock')
+    def test_process_bid_commits_without_lock(self, mock_cache_lock):
+        result = process_bid(str(self.user.id), str(self.auction.id), 150.0)  # type:ignore
+        self.assertEqual(result, "Bid processed successfully.")
+        mock_cache_lock.assert_not_called()
+
+        self.auction.refresh_from_db()
+        self.item.refresh_from_db()
+        self.assertEqual(float(self.auction.current_price), 150.0)
+        self.assertEqual(float(self.item.active_price), 150.0)
+        self.assertTrue(Bid.objects.filter(auction=self.auction, amount=150.0).exists())
+
+    def test_process_bid_rejects_without_writing(self):
+        result = process_bid(str(self.user.id), str(self.auction.id), 90.0)  # type:ignore
+        self.assertEqual(result, "Bid amount must be higher than current price.")
+
+        AuctionItem.objects.filter(id=self.item.id).update(
+            auction_end_date=timezone.now() - timedelta(minutes=1))
+        result = process_bid(str(self.user.id), str(self.auction.id), 150.0)  # type:ignore
+        self.assertEqual(result, "Auction does not exist or is not active.")
+        self.assertFalse(Bid.objects.filter(auction=self.auction).exists())
+
+
+@override_settings(CHANNEL_LAYERS={
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    }
+})
+class AuctionConsumerBidTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass123"
+        )
+        self.auction_id = str(uuid.uuid4())
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        live.add_live_auction_ids([self.auction_id])
+
+    def tearDown(self):
+        client = live.get_redis_client()
+        client.srem(live.LIVE_AUCTION_IDS_KEY, self.auction_id)
+        client.hdel(identity.ACTIVE_USERS_KEY, str(self.user.id))
+
+    def communicator(self):
+        return WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/auctions/{self.auction_id}/")
+
+    @patch('auction.consumers.submit_bid', return_value=(live.ACCEPTED, 'bid-1'))
+    async def test_bid_frame_is_queued_after_auth(self, mock_submit):
+        communicator = self.communicator()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({"action": "bid", "amount": 150, "ref": "a"})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["data"]["status"], "rejected")
+        mock_submit.assert_not_called()
+
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack, {"type": "auth_ack", "data": {"authenticated": True}})
+
+        await communicator.send_json_to({"action": "bid", "amount": 150, "ref": "b"})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["type"], "bid_ack")
+        self.assertEqual(ack["data"], {"ref": "b", "status": "queued", "bid_id": "bid-1"})
+        mock_submit.assert_called_once_with(str(self.user.id), self.auction_id, 150.0, bidder=None)
+        await communicator.disconnect()
+
+    @patch('auction.consumers.submit_bid', return_value=(live.ACCEPTED, 'bid-1'))
+    async def test_deactivated_users_cannot_bid(self, mock_submit):
+        communicator = self.communicator()
+        await communicator.connect()
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        await communicator.receive_json_from()
+
+        self.user.is_active = False
+        await sync_to_async(self.user.save)(update_fields=['is_active'])
+        await communicator.send_json_to({"action": "bid", "amount": 150, "ref": "a"})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["data"]["status"], "rejected")
+        self.assertEqual(ack["data"]["detail"], live.REJECTION_MESSAGES[live.FORBIDDEN])
+        mock_submit.assert_not_called()
+
+        # the token is still valid, but no longer authenticates
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack, {"type": "auth_ack", "data": {"authenticated": False}})
+        await communicator.disconnect()
+
+    async def test_deleted_users_cannot_authenticate(self):
+        await sync_to_async(self.user.delete)()
+        communicator = self.communicator()
+        await communicator.connect()
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack, {"type": "auth_ack", "data": {"authenticated": False}})
+        await communicator.disconnect()
+
+    @override_settings(WEBSOCKET_BIDS_PER_SECOND=2)
+    @patch('auction.live.time.time', return_value=1_000_000.0)
+    @patch('auction.consumers.submit_bid', return_value=(live.ACCEPTED, 'bid-1'))
+    async def test_bid_frames_are_rate_limited(self, mock_submit, mock_time):
+        communicator = self.communicator()
+        await communicator.connect()
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        await communicator.receive_json_from()
+
+        statuses = []
+        for ref in range(3):
+            await communicator.send_json_to({"action": "bid", "amount": 150 + ref, "ref": ref})
+            statuses.append((await communicator.receive_json_from())["data"]["status"])
+        self.assertEqual(statuses, ["queued", "queued", "rejected"])
+        self.assertEqual(mock_submit.call_count, 2)
+        await communicator.disconnect()
+        live.get_redis_client().delete(live.BID_RATE_KEY.format(user_id=self.user.id, second=1_000_000))
+
+    async def test_connect_sends_snapshot_of_live_auction(self):
+        client = live.get_redis_client()
+        client.hset(live.live_auction_key(self.auction_id), mapping={
+            "price": "150.00", "start_ts": 0, "end_ts": 4102444800,
+            "currency": "Dollars", "bid_count": 1})
+        client.zadd(live.recent_bids_key(self.auction_id), {
+            live.bid_entry(150.0, "bidder", timezone.now()): 150})
+        try:
+            communicator = self.communicator()
+            await communicator.connect()
+            snapshot = await communicator.receive_json_from()
+            await communicator.disconnect()
+        finally:
+            client.delete(live.live_auction_key(self.auction_id), live.recent_bids_key(self.auction_id))
+
+        self.assertEqual(snapshot["type"], "auction_snapshot")
+        self.assertEqual(snapshot["data"]["price"], "150.00")
+        self.assertEqual(snapshot["data"]["end_time"], "2100-01-01T00:00:00+00:00")
+        self.assertEqual(snapshot["data"]["bid_count"], 1)
+        self.assertEqual(snapshot["data"]["recent_bids"][0]["bidder"], "bidder")
+
+    async def test_watchers_are_counted_as_viewers(self):
+        client = live.get_redis_client()
+        client.hset(live.live_auction_key(self.auction_id), mapping={
+            "price": "150.00", "start_ts": 0, "end_ts": 4102444800,
+            "currency": "Dollars", "bid_count": 0})
+        try:
+            first, second = self.communicator(), self.communicator()
+            await first.connect()
+            await second.connect()
+            await first.receive_json_from()
+            snapshot = await second.receive_json_from()
+            self.assertEqual(snapshot["data"]["viewers"], 2)
+            await first.disconnect()
+            await second.disconnect()
+
+            with patch('auction.broadcaster.async_to_sync') as mock_async_to_sync:
+                await sync_to_async(broadcaster.send_update)(self.auction_id, {
+                    "new_price": "160.00", "bidder": "bidder", "timestamp": "2025-09-08T12:30:05+00:00"})
+            update = mock_async_to_sync.return_value.call_args.args[1]
+            self.assertEqual(json.loads(update["frame"])["data"]["viewers"], 2)
+        finally:
+            client.delete(
+                live.live_auction_key(self.auction_id),
+                live.EVENT_SEQUENCE_KEY.format(auction_id=self.auction_id),
+                live.EVENT_STREAM_KEY.format(auction_id=self.auction_id),
+                broadcaster.LAST_UPDATE_KEY.format(auction_id=self.auction_id),
+                *live._viewer_keys(self.auction_id))
+
+    async def test_only_live_auctions_are_watched(self):
+        closed_id, unknown_id = str(uuid.uuid4()), str(uuid.uuid4())
+        live.close_live_auction(closed_id, {"final_price": "210.00", "winner": "bidder", "auction_id": closed_id})
+        try:
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/auctions/{closed_id}/")
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["type"], "auction_closed")
+            self.assertEqual(frame["data"]["final_price"], "210.00")
+            self.assertEqual((await communicator.receive_output())["type"], "websocket.close")
+        finally:
+            live.get_redis_client().delete(live.FINAL_STATE_KEY.format(auction_id=closed_id))
+
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/auctions/{unknown_id}/")
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertFalse(get_channel_layer().groups.get(f"auction_{unknown_id}"))  # type:ignore
+
+    # any frame that has to wait is already too late
+    @override_settings(WEBSOCKET_MAX_LAG_SECONDS=-1)
+    async def test_lagging_client_is_disconnected(self):
+        communicator = self.communicator()
+        await communicator.connect()
+        client = live.get_redis_client()
+        before = await sync_to_async(get_connection_stats)()
+        await get_channel_layer().group_send(f"auction_{self.auction_id}", {  # type:ignore
+            "type": "auction.update",
+            "auction_id": self.auction_id,
+            "frame": broadcaster.encode_frame('auction_update', {"new_price": "150.00"}),
+        })
+        output = await communicator.receive_output()
+        while output["type"] != "websocket.close":
+            output = await communicator.receive_output()
+        self.assertEqual(output["code"], LAGGING_CLOSE_CODE)
+        await communicator.disconnect()
+        after = await sync_to_async(get_connection_stats)()
+        self.assertEqual(after[LAGGING_DISCONNECTS], before[LAGGING_DISCONNECTS] + 1)
+        await sync_to_async(client.hincrby)(WEBSOCKET_STATS_KEY, LAGGING_DISCONNECTS, -1)
+
+    async def test_reconnect_replays_missed_events(self):
+        client = live.get_redis_client()
+        frames = [
+            broadcaster.encode_frame('auction_update', {"new_price": price, "auction_id": self.auction_id, "seq": seq})
+            for seq, price in ((1, "150.00"), (2, "160.00"), (3, "170.00"))
+        ]
+        for seq, frame in enumerate(frames, start=1):
+            live.append_event(self.auction_id, seq, frame, b"", client=client)
+        client.set(live.EVENT_SEQUENCE_KEY.format(auction_id=self.auction_id), 3)
+        try:
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/auctions/{self.auction_id}/?since=1")
+            await communicator.connect()
+            self.assertEqual([await communicator.receive_from() for _ in range(2)], frames[1:])
+
+            # an update the replay already delivered is not sent twice
+            await get_channel_layer().group_send(f"auction_{self.auction_id}", {  # type:ignore
+                "type": "auction.update", "auction_id": self.auction_id, "seq": 3, "frame": frames[2]})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+        finally:
+            client.delete(
+                live.EVENT_SEQUENCE_KEY.format(auction_id=self.auction_id),
+                live.EVENT_STREAM_KEY.format(auction_id=self.auction_id))
+
+    async def test_group_frames_are_forwarded_as_encoded(self):
+        communicator = self.communicator()
+        await communicator.connect()
+        frame = broadcaster.encode_frame('auction_update', {"new_price": "150.00", "bid_count": 1})
+        await get_channel_layer().group_send(  # type:ignore
+            f"auction_{self.auction_id}", {"type": "auction.update", "frame": frame})
+        self.assertEqual(await communicator.receive_from(), frame)
+        await communicator.disconnect()
+
+    async def test_compact_subprotocol_gets_delta_updates(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/auctions/{self.auction_id}/",
+            subprotocols=[compact.SUBPROTOCOL])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, compact.SUBPROTOCOL)
+
+        channel_layer = get_channel_layer()
+        updates = [
+            {"new_price": "150.00", "currency": "Dollars", "bidder": "bidder",
+             "timestamp": "2025-09-08T12:30:05+00:00", "bid_count": 1, "seq": 7},
+            {"new_price": "152.50", "currency": "Dollars", "bidder": "bidder",
+             "timestamp": "2025-09-08T12:30:06+00:00", "bid_count": 2, "seq": 8},
+            {"new_price": "160.00", "currency": "Dollars", "bidder": "rival",
+             "timestamp": "2025-09-08T12:30:09+00:00", "bid_count": 1, "seq": 10},
+        ]
+        previous = None
+        for message in updates:
+            await channel_layer.group_send(f"auction_{self.auction_id}", {  # type:ignore
+                "type": "auction.update",
+                "seq": message["seq"],
+                "frame": broadcaster.encode_frame('auction_update', message),
+                "compact": compact.encode_update(message),
+                "compact_delta": compact.encode_delta(message, previous) if previous else None,
+            })
+            previous = message
+
+        frames = [msgpack.unpackb(await communicator.receive_from(), raw=False) for _ in updates]
+        self.assertEqual(frames[0], [compact.UPDATE, 7, 15000, "Dollars", "bidder", 1757334605000, 1, 0])
+        self.assertEqual(frames[1], [compact.DELTA, 8, 250, None, 1000, 2, 0])
+        # seq 9 never reached this socket, so it gets the full frame
+        self.assertEqual(frames[2][:3], [compact.UPDATE, 10, 16000])
+
+        await communicator.send_to(bytes_data=msgpack.packb({"action": "bid", "amount": 150}))
+        ack = msgpack.unpackb(await communicator.receive_from(), raw=False)
+        self.assertEqual(ack["type"], "bid_ack")
+        self.assertEqual(ack["data"]["detail"], "Authentication required")
+        await communicator.disconnect()
+
+    @patch('auction.consumers.submit_bid', return_value=(live.TOO_LOW, None))
+    async def test_losing_bid_frame_is_rejected(self, mock_submit):
+        communicator = self.communicator()
+        await communicator.connect()
+        await communicator.send_json_to({"action": "auth", "token": self.token})
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({"action": "bid", "amount": 100})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["data"]["status"], "rejected")
+        self.assertEqual(ack["data"]["detail"], live.REJECTION_MESSAGES[live.TOO_LOW])
+        await communicator.disconnect()
+
+
+@override_settings(
+    AUCTION_SUBSCRIPTION_LIMIT=3,
+    CHANNEL_LAYERS={
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        }
+    })
+class AuctionSubscriptionsConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.live_ids = sorted(str(uuid.uuid4()) for _ in range(3))
+        live.add_live_auction_ids(self.live_ids)
+
+    def tearDown(self):
+        live.get_redis_client().srem(live.LIVE_AUCTION_IDS_KEY, *self.live_ids)
+
+    async def test_one_socket_watches_many_auctions(self):
+        first, second, third = self.live_ids
+        unknown = str(uuid.uuid4())
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/auctions/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({"action": "subscribe", "auction_ids": [first, second, unknown]})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack, {"type": "subscribe_ack", "data": {
+            "status": "subscribed", "auction_ids": [first, second], "unknown_ids": [unknown]}})
+        self.assertFalse(get_channel_layer().groups.get(f"auction_{unknown}"))  # type:ignore
+
+        # unknown ids count against the limit too, so it is checked before Redis
+        with patch('auction.consumers.live.get_watch_states') as mock_watch_states:
+            for auction_ids in ([third, str(uuid.uuid4())], [str(uuid.uuid4()) for _ in range(1000)]):
+                await communicator.send_json_to({"action": "subscribe", "auction_ids": auction_ids})
+                ack = await communicator.receive_json_from()
+                self.assertEqual(ack["data"]["status"], "rejected")
+                self.assertEqual(ack["data"]["auction_ids"], [first, second])
+        mock_watch_states.assert_not_called()
+
+        channel_layer = get_channel_layer()
+        for auction_id in (first, second):
+            await channel_layer.group_send(f"auction_{auction_id}", {  # type:ignore
+                "type": "auction.update",
+                "frame": broadcaster.encode_frame('auction_update', {"auction_id": auction_id}),
+            })
+        received = [(await communicator.receive_json_from())["data"]["auction_id"] for _ in range(2)]
+        self.assertEqual(received, [first, second])
+
+        await communicator.send_json_to({"action": "unsubscribe", "auction_ids": [first]})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["data"]["auction_ids"], [second])
+        await channel_layer.group_send(f"auction_{first}", {  # type:ignore
+            "type": "auction.update",
+            "frame": broadcaster.encode_frame('auction_update', {"auction_id": first}),
+        })
+        self.assertTrue(await communicator.receive_nothing())
+
+        await communicator.send_json_to({"action": "subscribe", "auction_ids": "not-a-list"})
+        ack = await communicator.receive_json_from()
+        self.assertEqual(ack["data"]["status"], "rejected")
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    }
+})
+class WatchEndpointTests(TransactionTestCase):
+    def setUp(self):
+        self.auction_id = str(uuid.uuid4())
+        live.add_live_auction_ids([self.auction_id])
+
+    def tearDown(self):
+        client = live.get_redis_client()
+        client.srem(live.LIVE_AUCTION_IDS_KEY, self.auction_id)
+        client.delete(live.live_auction_key(self.auction_id), *live._viewer_keys(self.auction_id))
+
+    def communicator(self, auction_id):
+        return WebsocketCommunicator(URLRouter(watch_urlpatterns), f"/ws/watch/{auction_id}/")
+
+    async def test_anonymous_watchers_get_snapshot_and_updates(self):
+        live.get_redis_client().hset(live.live_auction_key(self.auction_id), mapping={
+            "price": "150.00", "start_ts": 0, "end_ts": 4102444800,
+            "currency": "Dollars", "bid_count": 0})
+        communicator = self.communicator(self.auction_id)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot["type"], "auction_snapshot")
+        self.assertEqual(snapshot["data"]["viewers"], 1)
+
+        # read-only, whatever the client sends is ignored
+        await communicator.send_json_to({"action": "bid", "amount": 150})
+        self.assertTrue(await communicator.receive_nothing())
+
+        frame = broadcaster.encode_frame('auction_update', {"new_price": "160.00", "seq": 1})
+        for _ in range(2):
+            await get_channel_layer().group_send(f"auction_{self.auction_id}", {  # type:ignore
+                "type": "auction.update", "auction_id": self.auction_id, "seq": 1, "frame": frame})
+        self.assertEqual(await communicator.receive_from(), frame)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        self.assertFalse(get_channel_layer().groups.get(f"auction_{self.auction_id}"))  # type:ignore
+
+    async def test_unknown_auctions_are_refused(self):
+        with patch.object(type(get_channel_layer()), 'group_add') as mock_group_add:
+            connected, _ = await self.communicator(str(uuid.uuid4())).connect()
+        self.assertFalse(connected)
+        mock_group_add.assert_not_called()
+
+
+class LatestValueOutboxTests(TestCase):
+    def test_waiting_updates_are_replaced_by_the_latest(self):
+        written = []
+
+        async def write(frame):
+            written.append(frame)
+
+        async def scenario():
+            outbox = LatestValueOutbox()
+            for price in ("150", "160", "170"):
+                outbox.put(partial(write, f"a:{price}"), key=('update', 'a'))
+            outbox.put(partial(write, "b:90"), key=('update', 'b'))
+            outbox.put(partial(write, "closed"))
+            outbox.put(partial(write, "a:180"), key=('update', 'a'))
+            self.assertEqual(outbox.dropped, 3)
+
+            # the oldest frame decides how far behind the client is
+            key = ('update', 'a')
+            outbox.pending[key] = (outbox.pending[key][0], outbox.pending[key][1] - 20)
+            self.assertGreaterEqual(outbox.lag(), 20)
+
+            task = asyncio.create_task(outbox.run())
+            await asyncio.sleep(0)
+            task.cancel()
+            self.assertEqual(outbox.lag(), 0.0)
+
+        async_to_sync(scenario)()
+        self.assertEqual(written, ["a:180", "b:90", "closed"])
+
+
+@override_settings(CHANNEL_LAYERS={
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    }
+})
+class BidWriteAmplificationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="bidder", email="bidder@example.com", password="pass123"
+        )
+        self.item = AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Clock",
+            details="Wall clock",
+            auction_start_date=timezone.now() - timedelta(minutes=5),
+            auction_end_date=timezone.now() + timedelta(minutes=30),
+            initial_price="100.00",
+            price_currency="Dollars"
+        )
+        self.auction = Auction.objects.create(
+            item_for_sale=self.item,
+            current_price=self.item.initial_price,
+            ongoing=True
+        )
+
+    @patch('auction.broadcaster.flush_auction_update.apply_async')
+    @patch('auction.tasks.cache.lock')
+    @patch('auction.tasks.cache.client.get_client')
+    def test_bid_writes_only_price_columns(self, mock_redis, mock_cache_lock, mock_flush):
+        mock_redis_client = MagicMock()
+        mock_redis.return_value = mock_redis_client
+
+        with CaptureQueriesContext(connection) as ctx, \
+                self.captureOnCommitCallbacks(execute=True):
+            result = process_bid(  # type:ignore
+                str(self.user.id), str(self.auction.id), 150.0, bidder="bidder")
+        self.assertEqual(result, "Bid processed successfully.")
+
+        writes = [q['sql'] for q in ctx.captured_queries
+                  if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+        self.assertEqual(len(writes), 3, writes)
+        item_writes = [sql for sql in writes if sql.startswith('UPDATE "auction_auctionitem"')]
+        self.assertEqual(len(item_writes), 1)
+        self.assertNotIn('search_vector', item_writes[0])
+        self.assertFalse(any('to_tsvector' in sql for sql in writes))
+        # select auction, savepoint, 3 writes, release savepoint
+        self.assertEqual(len(ctx.captured_queries), 6)
+
+        # script calls to raise the cached price and conflate the update, one pipeline for the bid result
+        mock_redis_client.zadd.assert_not_called()
+        self.assertEqual(mock_redis_client.register_script.call_count, 2)
+        self.assertEqual(mock_redis_client.pipeline.call_count, 1)
+
+    @patch('auction.models.cache.client.get_client')
+    def test_item_save_maintains_schedule_and_search_only_on_change(self, mock_redis):
+        mock_redis_client = MagicMock()
+        mock_redis.return_value = mock_redis_client
+        item = AuctionItem.objects.get(id=self.item.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            item.save()
+        self.assertFalse(any('to_tsvector' in q['sql'] for q in ctx.captured_queries))
+        mock_redis_client.zadd.assert_not_called()
+
+        item.item_name = "Cuckoo clock"
+        item.auction_start_date = item.auction_start_date + timedelta(minutes=1)
+        with CaptureQueriesContext(connection) as ctx:
+            item.save()
+        self.assertTrue(any('to_tsvector' in q['sql'] for q in ctx.captured_queries))
+        mock_redis_client.zadd.assert_called_once()
+
+
+@override_settings(AUCTION_BROADCAST_WINDOW_MS=250)
+class ConflatingBroadcasterTests(TestCase):
+    auction_id = "9f1c2a4e-0000-4000-8000-000000000001"
+
+    def tearDown(self):
+        cache.client.get_client().delete(  # type:ignore
+            broadcaster.PENDING_UPDATE_KEY.format(auction_id=self.auction_id),
+            broadcaster.FLUSH_SCHEDULED_KEY.format(auction_id=self.auction_id),
+        )
+
+    @patch('auction.broadcaster.send_update')
+    @patch('auction.broadcaster.flush_auction_update.apply_async')
+    def test_updates_in_a_window_are_sent_as_one(self, mock_flush, mock_send):
+        for price in ("150.00", "170.00", "160.00"):
+            broadcaster.publish_update(self.auction_id, {"new_price": price, "bidder": f"bidder {price}"})
+        mock_flush.assert_called_once_with(kwargs={"auction_id": self.auction_id}, countdown=0.25)
+        mock_send.assert_not_called()
+
+        broadcaster.flush_auction_update(self.auction_id)  # type:ignore
+        mock_send.assert_called_once_with(
+            self.auction_id, {"new_price": "170.00", "bidder": "bidder 170.00", "bid_count": 3})
+
+        self.assertEqual(broadcaster.flush_auction_update(self.auction_id), "Nothing to send.")  # type:ignore
+        broadcaster.publish_update(self.auction_id, {"new_price": "180.00"}, bid_count=2)
+        self.assertEqual(mock_flush.call_count, 2)
+
+    @patch('auction.broadcaster.async_to_sync')
+    def test_updates_are_numbered_per_auction(self, mock_async_to_sync):
+        client = cache.client.get_client()  # type:ignore
+        try:
+            broadcaster.send_update(self.auction_id, {
+                "new_price": "150.00", "bidder": "bidder", "timestamp": "2025-09-08T12:30:05+00:00"})
+            broadcaster.send_update(self.auction_id, {
+                "new_price": "170.00", "bidder": "bidder", "timestamp": "2025-09-08T12:30:07+00:00"})
+        finally:
+            client.delete(
+                live.EVENT_SEQUENCE_KEY.format(auction_id=self.auction_id),
+                live.EVENT_STREAM_KEY.format(auction_id=self.auction_id),
+                broadcaster.LAST_UPDATE_KEY.format(auction_id=self.auction_id))
+
+        first, second = [call.args[1] for call in mock_async_to_sync.return_value.call_args_list]
+        self.assertEqual((first["seq"], second["seq"]), (1, 2))
+        self.assertIsNone(first["compact_delta"])
+        self.assertEqual(json.loads(second["frame"])["data"]["seq"], 2)
+        self.assertEqual(
+            msgpack.unpackb(second["compact_delta"]), [compact.DELTA, 2, 2000, None, 2000, 1, 0])
+
+    @patch('auction.broadcaster.async_to_sync')
+    def test_events_are_kept_for_resuming(self, mock_async_to_sync):
+        client = cache.client.get_client()  # type:ignore
+        try:
+            for price in ("150.00", "170.00"):
+                broadcaster.send_update(self.auction_id, {
+                    "new_price": price, "bidder": "bidder", "timestamp": "2025-09-08T12:30:05+00:00"})
+            broadcaster.send_closed(self.auction_id, {"final_price": "170.00", "winner": "bidder"})
+
+            events = live.read_events_since(self.auction_id, 1)
+            self.assertEqual([seq for seq, _, _ in events], [2, 3])  # type:ignore
+            self.assertEqual(json.loads(events[0][1])["data"]["new_price"], "170.00")  # type:ignore
+            self.assertEqual(msgpack.unpackb(events[1][2], raw=False)["type"], "auction_closed")  # type:ignore
+            self.assertEqual(live.read_events_since(self.auction_id, 3), [])
+            self.assertIsNone(live.read_events_since(self.auction_id, 4))
+
+            # the oldest events were trimmed away, the client needs a snapshot
+            client.xtrim(live.EVENT_STREAM_KEY.format(auction_id=self.auction_id), maxlen=1, approximate=False)
+            self.assertIsNone(live.read_events_since(self.auction_id, 1))
+            self.assertEqual(len(live.read_events_since(self.auction_id, 2)), 1)  # type:ignore
+        finally:
+            client.delete(
+                live.EVENT_SEQUENCE_KEY.format(auction_id=self.auction_id),
+                live.EVENT_STREAM_KEY.format(auction_id=self.auction_id),
+                broadcaster.LAST_UPDATE_KEY.format(auction_id=self.auction_id))
+
+    @override_settings(AUCTION_BROADCAST_WINDOW_MS=0)
+    @patch('auction.broadcaster.send_update')
+    def test_zero_window_sends_right_away(self, mock_send):
+        broadcaster.publish_update(self.auction_id, {"new_price": "150.00"})
+        mock_send.assert_called_once_with(self.auction_id, {"new_price": "150.00", "bid_count": 1})
+
+
+class AuctionSchedulerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="seller", email="seller@example.com", password="pass123"
+        )
+        self.redis_client = live.get_redis_client()
+        self.redis_client.delete(scheduler.AUCTION_SCHEDULE_KEY, scheduler.AUCTION_ENDINGS_KEY)
+
+    def tearDown(self):
+        self.redis_client.delete(scheduler.AUCTION_SCHEDULE_KEY, scheduler.AUCTION_ENDINGS_KEY)
+        for auction_id in Auction.objects.values_list('id', flat=True):
+            self.redis_client.srem(live.LIVE_AUCTION_IDS_KEY, str(auction_id))
+            self.redis_client.zrem(phases.PHASE_TIMERS_KEY, *[
+                f"{auction_id}:{phase}" for phase in (phases.STARTED, phases.ENDING_SOON, phases.ENDED)])
+            self.redis_client.delete(live.live_auction_key(auction_id), live.recent_bids_key(auction_id))
+
+    def create_item(self, start):
+        return AuctionItem.objects.create(
+            creator=self.user,
+            item_name="Watch",
+            details="Vintage watch",
+            auction_start_date=start,
+            auction_end_date=start + timedelta(hours=1),
+            initial_price="150.00",
+            active_price="150.00",
+            price_currency="Dollars"
+        )
+
+    def test_auctions_start_at_their_start_second(self):
+        start = timezone.now() + timedelta(seconds=30)
+        item = self.create_item(start)
+        later_item = self.create_item(start + timedelta(seconds=1))
+        self.assertAlmostEqual(scheduler.seconds_until_next_run(), 30, delta=1)  # type:ignore
+
+        self.assertEqual(scheduler.activate_due_auctions(start - timedelta(milliseconds=1)), 0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(scheduler.activate_due_auctions(start), 1)
+
+        auction = Auction.objects.get(item_for_sale=item)
+        self.assertFalse(Auction.objects.filter(item_for_sale=later_item).exists())
+        # watchable and closable only once committed
+        self.assertEqual(live.get_watch_states([auction.id])[str(auction.id)], (False, None))
+        self.assertIsNone(self.redis_client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)))
+        with patch('auction.phases.broadcaster.send_events'):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(live.get_watch_states([auction.id])[str(auction.id)], (True, None))
+        self.assertEqual(live.get_snapshot(auction.id)["price"], "150.00")  # type:ignore
+        self.assertEqual(
+            self.redis_client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)), item.auction_end_date.timestamp())
+        self.assertEqual(
+            self.redis_client.zrange(scheduler.AUCTION_SCHEDULE_KEY, 0, -1), [str(later_item.id).encode()])
+
+    @patch('auction.phases.broadcaster.send_events')
+    def test_started_phase_is_sent_when_auctions_start(self, mock_send_events):
+        item = self.create_item(timezone.now())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(scheduler.activate_due_auctions(), 1)
+
+        auction = Auction.objects.get(item_for_sale=item)
+        # too late for a timer, only the later phases are on one
+        self.assertEqual(phases.claim_due_timers(item.auction_end_date), [
+            (str(auction.id), phases.ENDING_SOON), (str(auction.id), phases.ENDED)])
+        event_type, frame_type, messages = mock_send_events.call_args.args
+        self.assertEqual((event_type, frame_type), ('auction.phase', 'auction_phase'))
+        self.assertEqual(messages[str(auction.id)]["phase"], phases.STARTED)
+        self.assertEqual(messages[str(auction.id)]["end_time"], item.auction_end_date.isoformat())
+        self.assertAlmostEqual(messages[str(auction.id)]["seconds_left"], 3600, delta=1)
+
+    def test_moved_end_of_started_auction_reaches_redis(self):
+        item = self.create_item(timezone.now() - timedelta(minutes=5))
+        with self.captureOnCommitCallbacks(execute=True), patch('auction.phases.broadcaster.send_events'):
+            scheduler.activate_due_auctions()
+        auction = Auction.objects.get(item_for_sale=item)
+        old_end = item.auction_end_date
+
+        item.auction_end_date = old_end + timedelta(hours=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        self.assertEqual(
+            self.redis_client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)), item.auction_end_date.timestamp())
+        self.assertEqual(live.get_snapshot(auction.id)["end_time"], item.auction_end_date.isoformat())  # type:ignore
+        self.assertEqual(live.check_bid(auction.id, 200, now=old_end + timedelta(minutes=1)), live.ACCEPTED)
+
+        # claimed at its old end, the closer leaves it open and puts it back
+        self.redis_client.zrem(scheduler.AUCTION_ENDINGS_KEY, str(auction.id))
+        self.assertEqual(_close_auctions([str(auction.id)], old_end + timedelta(minutes=1)), 0)
+        self.assertEqual(
+            self.redis_client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)), item.auction_end_date.timestamp())
+
+    def test_items_that_already_ended_are_not_started(self):
+        item = self.create_item(timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.redis_client.zcard(scheduler.AUCTION_SCHEDULE_KEY), 1)
+        self.assertEqual(scheduler.activate_due_auctions(), 0)
+        self.assertFalse(Auction.objects.filter(item_for_sale=item).exists())
+        self.assertEqual(self.redis_client.zcard(scheduler.AUCTION_SCHEDULE_KEY), 0)
+
+    def test_overdue_items_are_started_in_bulk(self):
+        # started while nothing was scheduled, one of them even dropped from the schedule
+        items = [self.create_item(timezone.now() - timedelta(minutes=10)) for _ in range(3)]
+        self.redis_client.zrem(scheduler.AUCTION_SCHEDULE_KEY, str(items[0].id))
+        Auction.objects.create(item_for_sale=items[1], current_price="150.00")
+        self.create_item(timezone.now() - timedelta(hours=2))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(scheduler.catch_up_overdue_auctions(), 2)
+        self.assertLessEqual(len(queries), 6)
+        self.assertEqual(Auction.objects.filter(item_for_sale__in=items).count(), 3)
+        self.assertEqual(self.redis_client.zcard(scheduler.AUCTION_SCHEDULE_KEY), 2)
+        self.assertEqual(scheduler.catch_up_overdue_auctions(), 0)
+
+    def test_auctions_started_elsewhere_are_skipped(self):
+        item = self.create_item(timezone.now() - timedelta(seconds=1))
+        Auction.objects.create(item_for_sale=item, current_price="150.00")
+        self.assertEqual(scheduler.activate_items([item]), 0)
+        self.assertEqual(Auction.objects.filter(item_for_sale=item).count(), 1)
+
+    @patch('auction.scheduler.live.prime_live_auction', side_effect=ConnectionError("redis down"))
+    def test_failed_starts_are_retried(self, mock_prime):
+        start = timezone.now() - timedelta(seconds=1)
+        item = self.create_item(start)
+        self.assertEqual(scheduler.activate_due_auctions(), 0)
+        retry_at = self.redis_client.zscore(scheduler.AUCTION_SCHEDULE_KEY, str(item.id))
+        self.assertGreater(retry_at, timezone.now().timestamp())
+        self.assertFalse(Auction.objects.filter(item_for_sale=item).exists())
+
+    @patch('auction.management.commands.run_auction_scheduler.close_old_connections')
+    @patch('auction.management.commands.run_auction_scheduler.close_finished_auctions')
+    @patch('auction.scheduler.seconds_until_next_run', return_value=None)
+    @patch('auction.phases.fire_due_timers', return_value=0)
+    @patch('auction.scheduler.activate_due_auctions', side_effect=[ConnectionError("redis down"), 0])
+    @patch('auction.scheduler.catch_up_overdue_auctions', return_value=0)
+    def test_scheduler_keeps_running_after_a_failed_pass(
+            self, mock_catch_up, mock_activate, mock_fire, mock_wait, mock_close, mock_close_connections):
+        # the second nap ends the otherwise endless loop
+        with patch('auction.management.commands.run_auction_scheduler.time.sleep',
+                   side_effect=[None, KeyboardInterrupt]) as mock_sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('run_auction_scheduler', stdout=MagicMock())
+        self.assertEqual(mock_activate.call_count, 2)
+        mock_close.assert_called_once()
+        self.assertEqual(mock_close_connections.call_count, 2)
+        # backed off after the failure, then the regular nap
+        self.assertEqual([call.args[0] for call in mock_sleep.call_args_list], [1.0, 1.0])
+
+    def test_schedule_is_rebuilt_from_postgres(self):
+        start = timezone.now() + timedelta(minutes=5)
+        items = [self.create_item(start), self.create_item(start + timedelta(seconds=1))]
+        started = self.create_item(timezone.now() - timedelta(minutes=5))
+        auction = Auction.objects.create(item_for_sale=started, current_price="150.00")
+        self.create_item(timezone.now() - timedelta(hours=2))
+        self.redis_client.delete(scheduler.AUCTION_SCHEDULE_KEY, scheduler.AUCTION_ENDINGS_KEY)
+
+        progress = MagicMock()
+        self.assertEqual(scheduler.rebuild_schedule(chunk_size=1, progress=progress), (2, 1))
+        self.assertEqual(progress.call_args_list[-1].args, (2, 1))
+        self.assertEqual(
+            self.redis_client.zrange(scheduler.AUCTION_SCHEDULE_KEY, 0, -1, withscores=True),
+            [(str(item.id).encode(), item.auction_start_date.timestamp()) for item in items])
+        self.assertEqual(
+            self.redis_client.zscore(scheduler.AUCTION_ENDINGS_KEY, str(auction.id)), started.auction_end_date.timestamp())
+
+
+class PhaseTimerTests(TestCase):
+    def setUp(self):
+        self.redis_client = live.get_redis_client()
+        self.auction_id = str(uuid.uuid4())
+        self.starts_at = timezone.now() + timedelta(minutes=5)
+        self.ends_at = self.starts_at + timedelta(minutes=30)
+
+    def tearDown(self):
+        self.redis_client.zrem(phases.PHASE_TIMERS_KEY, *[
+            f"{self.auction_id}:{phase}" for phase in (phases.STARTED, phases.ENDING_SOON, phases.ENDED)])
+        self.redis_client.delete(live.live_auction_key(self.auction_id))
+
+    def test_rescheduling_moves_the_timers(self):
+        phases.schedule_phases(self.auction_id, self.starts_at, self.ends_at)
+        self.ends_at += timedelta(minutes=10)
+        phases.schedule_phases(self.auction_id, self.starts_at, self.ends_at)
+
+        self.assertEqual(phases.claim_due_timers(self.starts_at), [(self.auction_id, phases.STARTED)])
+        self.assertEqual(phases.claim_due_timers(self.starts_at + timedelta(minutes=30)), [])
+        self.assertEqual(
+            phases.claim_due_timers(self.ends_at),
+            [(self.auction_id, phases.ENDING_SOON), (self.auction_id, phases.ENDED)])
+        self.assertEqual(phases.claim_due_timers(self.ends_at), [])
+
+    @patch('auction.phases.broadcaster.send_phase')
+    def test_due_phases_are_sent_with_the_live_end_time(self, mock_send):
+        phases.schedule_phases(self.auction_id, self.starts_at, self.ends_at)
+        self.redis_client.hset(live.live_auction_key(self.auction_id), "end_ts", self.ends_at.timestamp())
+
+        now = self.ends_at - timedelta(seconds=60)
+        self.assertEqual(phases.fire_due_timers(now), 2)
+        self.assertEqual(
+            [call.args[1]["phase"] for call in mock_send.call_args_list], [phases.STARTED, phases.ENDING_SOON])
+        self.assertEqual(mock_send.call_args.args[1]["seconds_left"], 60)
+        self.assertEqual(mock_send.call_args.args[1]["end_time"], self.ends_at.isoformat())
+        self.assertIsNotNone(phases.seconds_until_next_timer())
+
+
+class UserIdentityCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="collector", email="collector@example.com", password="pass123"
+        )
+        self.redis_client = cache.client.get_client()  # type:ignore
+        self.redis_client.hdel(identity.USERNAMES_KEY, str(self.user.id))
+
+    def tearDown(self):
+        self.redis_client.hdel(identity.USERNAMES_KEY, str(self.user.id))
+
+    def test_usernames_are_loaded_once_then_served_from_redis(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(identity.get_username(self.user.id), "collector")
+        with self.assertNumQueries(0):
+            self.assertEqual(identity.get_usernames([self.user.id]), {str(self.user.id): "collector"})
+
+    def test_username_change_refreshes_cache(self):
+        identity.get_username(self.user.id)
+        self.user.username = "curator"
+        self.user.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(identity.get_username(self.user.id), "curator")
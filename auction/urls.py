@@ -14,5 +14,6 @@ urlpatterns = [
          views.AuctionItemImagesAPIView.as_view(), name='list_create_delete_auction_item_images'),
     path('', views.AuctionAPIView.as_view(), name="auction_view"),
     path('auctions/<uuid:auction_id>/bid', views.PlaceBidAPIView.as_view(), name='place_bid'),
+    path('bids/<uuid:bid_id>/', views.BidResultAPIView.as_view(), name='bid_result'),
     path('search/', views.MasterSearchAPIView.as_view(), name="master_search"),  
 ]
@@ -19,6 +19,7 @@ from utils.paginators import PaginationMixin
 
 
 from .docs import *
+from . import live, results
 
 from .models import (
     Auction,
@@ -42,7 +43,7 @@ from .serializers import (
     AuctionListSerializer,
 )
 
-from .tasks import process_bid
+from .tasks import submit_bid
 
 logger = logging.getLogger('auction')
 
@@ -322,7 +323,8 @@ class AuctionAPIView(PaginationMixin, APIView):
 
 class PlaceBidAPIView(APIView):
     """
-    Accepts a bid from an authenticated user and queues it for processing
+    Accepts a bid from an authenticated user and queues it for processing,
+    bids that cannot beat the live price are rejected without being queued
     """
     permission_classes = [IsAuthenticated]
     throttle_classes = [UserRateThrottle]
@@ -334,12 +336,18 @@ class PlaceBidAPIView(APIView):
             if not isinstance(amount, (int, float)) or amount <= 0:
                 return CustomResponse.bad_request("A valid bid amount is required")
 
-            process_bid.delay(
+            verdict, bid_id = submit_bid(
                 user_id=str(request.user.id),
                 auction_id=str(auction_id),
-                amount=float(amount)
-            )  # type: ignore
+                amount=float(amount),
+                bidder=request.user.username
+            )
+            if verdict == live.MISSING:
+                return CustomResponse.not_found(live.REJECTION_MESSAGES[verdict])
+            if verdict != live.ACCEPTED:
+                return CustomResponse.conflict(live.REJECTION_MESSAGES[verdict])
             return CustomResponse.success(
+                data={"bid_id": bid_id},
                 message="Your bid has been received and is being processed",
                 status_code=202
             )
@@ -347,3 +355,18 @@ class PlaceBidAPIView(APIView):
             logger.error(
                 f'Error queueing bid for auction {auction_id}: {e}', exc_info=True)
             return CustomResponse.internal_server_error("An error occured while placing your bid")
+
+
+class BidResultAPIView(APIView):
+    """
+    Returns the outcome of a queued bid, served from Redis without touching the database
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [UserRateThrottle]
+
+    @bid_result_doc()
+    def get(self, request, bid_id):
+        bid_result = results.get_bid_result(bid_id)
+        if bid_result is None or bid_result['user_id'] != str(request.user.id):
+            return CustomResponse.not_found("Bid result not found or expired")
+        return CustomResponse.success(data=bid_result)
@@ -0,0 +1,139 @@
+"""
+Read-only websocket endpoint for anonymous auction watchers.
+
+Served at ``ws/watch/<auction_id>/`` outside of the session and auth
+middleware, as a plain ASGI application instead of a consumer class. A watcher
+gets the same snapshot, updates and phase events as ``AuctionConsumer`` but
+cannot authenticate or bid, and all it keeps per connection is a `Watch`.
+Frames are forwarded in the order the channel layer hands them over. A client
+too slow to read them leaves them queued on its channel, and the channel layer
+drops what no longer fits there.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from . import compact, live
+from .broadcaster import encode_frame
+
+logger = logging.getLogger('auction')
+
+
+class Watch:
+    """All the state of one watching socket"""
+    __slots__ = ('auction_id', 'channel_name', 'compact', 'last_seq')
+
+    def __init__(self, auction_id, compact):
+        self.auction_id = auction_id
+        self.compact = compact
+        self.channel_name = None
+        self.last_seq = None
+
+
+async def watch_auction(scope, receive, send):
+    auction_id = scope['url_route']['kwargs']['auction_id']
+    watch = Watch(auction_id, compact.SUBPROTOCOL in scope.get('subprotocols', []))
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    # only live auctions get a group, unknown ids never reach the channel layer
+    is_live, final_state = (await sync_to_async(live.get_watch_states)([auction_id]))[auction_id]
+    if not is_live:
+        return await refuse(watch, send, final_state)
+    channel_layer = get_channel_layer()
+    group_name = f'auction_{auction_id}'
+    # joined before the state is read again so no update slips in between
+    watch.channel_name = await channel_layer.new_channel()  # type: ignore
+    await channel_layer.group_add(group_name, watch.channel_name)  # type: ignore
+    try:
+        is_live, final_state, snapshot = await sync_to_async(open_watch)(watch)
+        if not is_live:
+            return await refuse(watch, send, final_state)
+        await accept(watch, send)
+        if snapshot is not None:
+            await send_frame(watch, send, 'auction_snapshot', snapshot)
+            watch.last_seq = snapshot['seq']
+        await forward_events(watch, channel_layer, receive, send)
+    finally:
+        await channel_layer.group_discard(group_name, watch.channel_name)  # type: ignore
+
+
+def open_watch(watch):
+    """Whether the auction is live, its final state otherwise, and its snapshot, in one thread hop."""
+    client = live.get_redis_client()
+    is_live, final_state = live.get_watch_states([watch.auction_id], client=client)[watch.auction_id]
+    if not is_live:
+        return is_live, final_state, None
+    try:
+        live.mark_watching([watch.auction_id], watch.channel_name, client=client)
+    except Exception as e:
+        logger.error(f"Error counting watcher {watch.channel_name} as viewer: {e}")
+    return is_live, final_state, live.get_snapshot(watch.auction_id, client=client)
+
+
+async def refuse(watch, send, final_state):
+    """Closes the socket of an auction that is not live, sending its final state first if it has one."""
+    if final_state is not None:
+        await accept(watch, send)
+        await send_frame(watch, send, 'auction_closed', final_state)
+    await send({'type': 'websocket.close'})
+
+
+async def accept(watch, send):
+    await send({'type': 'websocket.accept', 'subprotocol': compact.SUBPROTOCOL if watch.compact else None})
+
+
+async def send_frame(watch, send, frame_type, data):
+    if watch.compact:
+        await send({'type': 'websocket.send', 'bytes': compact.pack(frame_type, data)})
+    else:
+        await send({'type': 'websocket.send', 'text': encode_frame(frame_type, data)})
+
+
+async def mark_watching(watch):
+    try:
+        await sync_to_async(live.mark_watching)([watch.auction_id], watch.channel_name)
+    except Exception as e:
+        logger.error(f"Error counting watcher {watch.channel_name} as viewer: {e}")
+
+
+async def forward_events(watch, channel_layer, receive, send):
+    """Relays group events to the socket until the client goes away, ignoring anything it sends."""
+    from_client = asyncio.ensure_future(receive())
+    from_group = asyncio.ensure_future(channel_layer.receive(watch.channel_name))
+    next_heartbeat = time.monotonic() + live.VIEWER_WINDOW_SECONDS
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {from_client, from_group},
+                timeout=max(next_heartbeat - time.monotonic(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if time.monotonic() >= next_heartbeat:
+                await mark_watching(watch)
+                next_heartbeat = time.monotonic() + live.VIEWER_WINDOW_SECONDS
+            if from_client in done:
+                if from_client.result()['type'] == 'websocket.disconnect':
+                    return
+                from_client = asyncio.ensure_future(receive())
+            if from_group in done:
+                await write_event(watch, send, from_group.result())
+                from_group = asyncio.ensure_future(channel_layer.receive(watch.channel_name))
+    finally:
+        from_client.cancel()
+        from_group.cancel()
+
+
+async def write_event(watch, send, event):
+    """Sends the pre-encoded frame of a group event, compact sockets always get full frames."""
+    seq = event.get('seq')
+    if seq is not None:
+        if watch.last_seq is not None and seq <= watch.last_seq:
+            return
+        watch.last_seq = seq
+    if watch.compact and event.get('compact'):
+        await send({'type': 'websocket.send', 'bytes': event['compact']})
+    elif event.get('frame'):
+        await send({'type': 'websocket.send', 'text': event['frame']})
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
+from django.urls import re_path
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import auction.routing
@@ -20,9 +21,12 @@ django_asgi_app = get_asgi_application()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
-        URLRouter(
-            auction.routing.websocket_urlpatterns
-        )
-    ),
+    "websocket": URLRouter([
+        *auction.routing.watch_urlpatterns,
+        re_path(r'', AuthMiddlewareStack(
+            URLRouter(
+                auction.routing.websocket_urlpatterns
+            )
+        )),
+    ]),
 })
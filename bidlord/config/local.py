@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 from datetime import timedelta
 import os
+import sys
 from pathlib import Path
 from celery.schedules import crontab
 
@@ -175,21 +176,51 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# How bids are decided: 'lock' compares in Postgres under a per-auction lock,
+# 'redis' compares and sets against the live auction record in Redis, 'batch'
+# coalesces pending bids per auction and matches them in one pass, 'optimistic'
+# commits with a single conditional UPDATE in Postgres and no lock
+BID_ACCEPTANCE_MODE = os.environ.get('BID_ACCEPTANCE_MODE', 'lock').lower()
+
+# Price updates of one auction are conflated over this window so a hot auction
+# sends a bounded number of frames, 0 sends every update as soon as it commits
+AUCTION_BROADCAST_WINDOW_MS = int(os.environ.get('AUCTION_BROADCAST_WINDOW_MS', 250))
+
+# How many bids one user may send per second over websockets, which are not
+# covered by the API throttles, bids past it are rejected
+WEBSOCKET_BIDS_PER_SECOND = int(os.environ.get('WEBSOCKET_BIDS_PER_SECOND', 5))
+
+# How many auctions one multiplexed websocket (ws/auctions/) may watch at once
+AUCTION_SUBSCRIPTION_LIMIT = int(os.environ.get('AUCTION_SUBSCRIPTION_LIMIT', 50))
+
+# Websockets only keep the latest pending update of each auction, a client
+# whose oldest undelivered frame is older than this is disconnected
+WEBSOCKET_MAX_LAG_SECONDS = float(os.environ.get('WEBSOCKET_MAX_LAG_SECONDS', 10))
+
+# auctions are started and closed at their second by `manage.py run_auction_scheduler`
 CELERY_BEAT_SCHEDULE = {
-    'create-auctions-from-cache-every-minute': {
-        'task': 'create_pending_auctions_from_cache',
-        'schedule': crontab(minute='*'),  
+    'reconcile-auction-endings': {
+        'task': 'reconcile_auction_endings',
+        'schedule': crontab(minute='*/10'),
     },
-    'close-finished-auctions': {
-        'task': 'close_finished_auctions',
+    'refresh-live-auction-ids': {
+        'task': 'refresh_live_auction_ids',
         'schedule': crontab(minute='*'),
     },
 }
 
+# `manage.py test` gets a Redis database of its own, the tests clear global
+# keys like the auction schedule that a running scheduler depends on
+TESTING = sys.argv[1:2] == ['test']
+REDIS_CACHE_URL = (
+    os.environ.get('TEST_REDIS_CACHE_URL', 'redis://127.0.0.1:6379/15') if TESTING
+    else os.environ.get('REDIS_CACHE_URL', 'redis://127.0.0.1:6379/1')
+)
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1", 
+        "LOCATION": REDIS_CACHE_URL,
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }